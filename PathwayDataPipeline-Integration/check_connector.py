@@ -0,0 +1,71 @@
+"""
+Smoke check of the live TomTom connector against mock_tomtom.py, no API key
+or network needed:
+
+    python check_connector.py
+
+Polls ``TomTomFlowSubject`` and ``TomTomIncidentSubject`` twice each
+against a rate-limited ``MockTomTom`` and checks that the second poll
+suppresses the rows that did not change, and that the mock's 429s were
+retried instead of dropping parts of the city. Exits non-zero on failure.
+"""
+import sys
+
+from mock_tomtom import MockTomTom
+# tomtom_connector puts the repo root (main.py, scheduler.py) on the path
+from tomtom_connector import TomTomFlowSubject, TomTomIncidentSubject, tomtom_client
+from scheduler import FamilyLimits, RequestScheduler
+
+# ~3km x 3km: a dozen flow points and incident tiles per poll
+BBOX = "-74.03,40.70,-74.00,40.73"
+# below what the client sends, so the mock answers some requests with 429
+MOCK_QPS = 4
+
+
+def _collect(subject):
+    # rows go to a list instead of a running Pathway graph
+    rows = []
+    subject.next = lambda **row: rows.append(row)
+    subject.commit = lambda: None
+    return rows
+
+
+def check(subject, name: str) -> bool:
+    rows = _collect(subject)
+    first = subject.poll_once()
+    second = subject.poll_once()
+    stats = subject.stats
+    print(f"{name}: first poll {first} rows, second poll {second} rows, {stats}")
+    failures = []
+    if first == 0:
+        failures.append("first poll emitted nothing")
+    if second != 0 or len(rows) != first or stats["unchanged"] != first:
+        failures.append("unchanged rows were emitted again")
+    if stats["errors"]:
+        failures.append("some calls failed instead of being retried")
+    for failure in failures:
+        print(f"  FAILED: {failure}")
+    return not failures
+
+
+def main() -> int:
+    # data changes once an hour, so nothing changes between the two polls
+    with MockTomTom(change_every_s=3600, incident_share=1.0, qps=MOCK_QPS) as mock:
+        # the client's own limits are well above the mock's, the mock is what pushes back
+        scheduler = RequestScheduler({
+            "flow": FamilyLimits(qps=100, burst=100),
+            "incidents": FamilyLimits(qps=100, burst=100),
+        })
+        api = tomtom_client("check-key", scheduler=scheduler, base_url=mock.url)
+        ok = check(TomTomFlowSubject(api, BBOX, spacing_km=1.0), "flow")
+        ok = check(TomTomIncidentSubject(api, BBOX, tile_km=1.0), "incidents") and ok
+        print(f"mock: {mock.requests} answered, {mock.rejected} rejected with 429")
+        if mock.rejected == 0:
+            print("  FAILED: the mock never rate limited, so retries were not exercised")
+            ok = False
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
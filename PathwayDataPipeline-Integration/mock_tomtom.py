@@ -0,0 +1,209 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# synthetic roads run east-west on a grid of this many degrees (~500m)
+GRID_DEG = 0.005
+# candidate incident spots, one per cell of this size (~2km)
+INCIDENT_GRID_DEG = 0.02
+
+
+def _seed(*parts) -> int:
+    return int(hashlib.sha1(repr(parts).encode()).hexdigest()[:12], 16)
+
+
+class MockTomTom:
+    """
+    Stand-in for the TomTom flow and incident endpoints, for running the
+    pipeline and the live connector without an API key.
+
+    Data is generated from the coordinates and the current period
+    (``change_every_s``), so repeated calls agree with each other and about
+    ``changing_share`` of the segments and incidents change per period.
+    With ``qps`` set, requests above that rate get a 429 with Retry-After,
+    like the real API.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, change_every_s: float = 30.0,
+                 changing_share: float = 0.3, incident_share: float = 0.15, qps: Optional[float] = None):
+        self.change_every_s = change_every_s
+        self.changing_share = changing_share
+        self.incident_share = incident_share
+        self.qps = qps
+        self.requests: Dict[str, int] = {}
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockTomTom":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-tomtom", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _period(self) -> int:
+        return int(time.time() // self.change_every_s)
+
+    def _version(self, *key) -> int:
+        # the period at which this item last changed
+        period = self._period()
+        rng = random.Random(_seed("changes", key))
+        return period if rng.random() < self.changing_share else period - period % 10
+
+    def flow(self, lat: float, lon: float) -> Dict:
+        row = round(lat / GRID_DEG)
+        col = int(lon // GRID_DEG)
+        start_lat, start_lon = row * GRID_DEG, col * GRID_DEG
+        base = random.Random(_seed("road", row, col))
+        free_flow = base.choice([30, 50, 70, 90])
+        now = random.Random(_seed("speed", row, col, self._version(row, col)))
+        current = max(3, round(free_flow * now.uniform(0.2, 1.0)))
+        return {
+            "flowSegmentData": {
+                "frc": "FRC3",
+                "currentSpeed": current,
+                "freeFlowSpeed": free_flow,
+                "currentTravelTime": round(GRID_DEG * 111320 / (current / 3.6)),
+                "freeFlowTravelTime": round(GRID_DEG * 111320 / (free_flow / 3.6)),
+                "confidence": round(now.uniform(0.6, 1.0), 2),
+                "roadClosure": False,
+                "coordinates": {"coordinate": [
+                    {"latitude": start_lat, "longitude": start_lon + i * GRID_DEG / 2} for i in range(3)
+                ]},
+            }
+        }
+
+    def incidents(self, bbox: Tuple[float, float, float, float]) -> Dict:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        features = []
+        row = int(min_lat // INCIDENT_GRID_DEG)
+        while row * INCIDENT_GRID_DEG <= max_lat:
+            col = int(min_lon // INCIDENT_GRID_DEG)
+            while col * INCIDENT_GRID_DEG <= max_lon:
+                version = self._version("incident", row, col)
+                rng = random.Random(_seed("incident", row, col, version))
+                if rng.random() < self.incident_share:
+                    lat = (row + rng.random()) * INCIDENT_GRID_DEG
+                    lon = (col + rng.random()) * INCIDENT_GRID_DEG
+                    if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                        features.append(self._incident(f"mock-{row}-{col}-{version}", lat, lon, rng))
+                col += 1
+            row += 1
+        return {"incidents": features}
+
+    def _incident(self, incident_id: str, lat: float, lon: float, rng: random.Random) -> Dict:
+        category, description = rng.choice([
+            (1, "Accident"), (6, "Stationary traffic"), (7, "Lane closed"), (9, "Roadworks"), (14, "Broken down vehicle")
+        ])
+        return {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {
+                "id": incident_id,
+                "iconCategory": category,
+                "magnitudeOfDelay": rng.randint(0, 4),
+                "events": [{"description": description}],
+                "from": "",
+                "delay": rng.randint(0, 900),
+            },
+        }
+
+    def _admit(self) -> bool:
+        if self.qps is None:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            if self._window_count > self.qps:
+                self.rejected += 1
+                return False
+            return True
+
+    def _count(self, path: str):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if not query.get("key"):
+                    self._send(403, {"error": "missing key"})
+                    return
+                if not mock._admit():
+                    self._send(429, {"error": "rate limit exceeded"}, {"Retry-After": "1"})
+                    return
+                try:
+                    if url.path.startswith("/traffic/services/4/flowSegmentData/"):
+                        mock._count("flow")
+                        lat, lon = (float(v) for v in query["point"].split(","))
+                        self._send(200, mock.flow(lat, lon))
+                    elif url.path == "/traffic/services/5/incidentDetails":
+                        mock._count("incidents")
+                        min_lon, min_lat, max_lon, max_lat = (float(v) for v in query["bbox"].split(","))
+                        self._send(200, mock.incidents((min_lon, min_lat, max_lon, max_lat)))
+                    else:
+                        self._send(404, {"error": "not found"})
+                except (KeyError, ValueError) as e:
+                    self._send(400, {"error": f"bad request: {e}"})
+
+            def _send(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the TomTom traffic APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--change-every", type=float, default=30.0, help="seconds between data changes")
+    parser.add_argument("--qps", type=float, default=None, help="answer 429 above this request rate")
+    args = parser.parse_args()
+    mock = MockTomTom(args.host, args.port, args.change_every, qps=args.qps)
+    print(f"Mock TomTom listening on {mock.url}")
+    try:
+        mock._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock._server.server_close()
@@ -8,7 +8,7 @@ from langchain.tools import DuckDuckGoSearchRun
 from langchain.tools import StructuredTool
 from pydantic import BaseModel
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime
 import json
 from dataclasses import dataclass
 from typing import List, Dict, Optional,Callable
@@ -17,8 +17,15 @@ import requests
 from langchain.tools import StructuredTool
 from pydantic import BaseModel
 import os
+import sys
 from dotenv import load_dotenv
 
+# shared helpers (traffic_cache, ...) live next to main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from traffic_cache import TrafficCache, quantize_point
+from geometry import compact_route_geometry
+from llm_cache import enable_llm_cache
+
 class SearchInput(BaseModel):
     query: str 
 search_tool = StructuredTool(
@@ -53,6 +60,10 @@ llm = ChatGroq(
     max_tokens=1024
 )
 
+# repeated prompts (same model settings, agent and task input) are answered
+# from cache; LLM_CACHE_PATH shares the answers between processes
+llm_cache = enable_llm_cache(os.environ.get("LLM_CACHE_PATH"))
+
 # 
 # class SearchInput(BaseModel):
 #     query: str
@@ -152,7 +163,8 @@ class TomTomAPI:
             "maxAlternatives": 3,
             "reportGeometry": "true"
         }
-        return self._make_request(endpoint, params)
+        # simplified, polyline-encoded legs instead of raw point arrays
+        return compact_route_geometry(self._make_request(endpoint, params))
 
     def _make_request(self, endpoint: str, params: Dict) -> Dict:
         try:
@@ -175,12 +187,13 @@ def get_bbox(start: Location, end: Location) -> str:
 ##CHANGED THIS INTEGRATION WITH PATHWAY
 
 class TrafficDataManager:
-       def __init__(self, tomtom_api: TomTomAPI):
+       def __init__(self, tomtom_api: TomTomAPI, cache: Optional[TrafficCache] = None,
+                    key_precision: int = 4):
            self.api = tomtom_api
+           # shared across trips; keyed by quantized coordinates per data kind
+           self.cache = cache if cache is not None else TrafficCache()
+           self.key_precision = key_precision
            self.pipeline = self.create_traffic_data_pipeline()
-           self.cache_duration = timedelta(minutes=5)
-           self.cache_timestamp = None
-           self.cached_data = {}
    
        def create_traffic_data_pipeline(self):
            # Define the data sources
@@ -190,10 +203,16 @@ class TrafficDataManager:
            # Define the data transformations
            def get_traffic_data(start: Location, end: Location):
                bbox = get_bbox(start, end)
-               start_traffic = self.api.get_traffic_flow(start.lat, start.lon)
-               end_traffic = self.api.get_traffic_flow(end.lat, end.lon)
-               incidents = self.api.get_incidents(bbox)
-               routes = self.api.calculate_route(start, end)
+               start_key = quantize_point(start.lat, start.lon, self.key_precision)
+               end_key = quantize_point(end.lat, end.lon, self.key_precision)
+               start_traffic = self.cache.get_or_fetch(
+                   "flow", start_key, lambda: self.api.get_traffic_flow(start.lat, start.lon))
+               end_traffic = self.cache.get_or_fetch(
+                   "flow", end_key, lambda: self.api.get_traffic_flow(end.lat, end.lon))
+               incidents = self.cache.get_or_fetch(
+                   "incidents", tuple(sorted((start_key, end_key))), lambda: self.api.get_incidents(bbox))
+               routes = self.cache.get_or_fetch(
+                   "routes", (start_key, end_key), lambda: self.api.calculate_route(start, end))
    
                return {
                    'start_traffic': start_traffic,
@@ -211,15 +230,16 @@ class TrafficDataManager:
            return pipeline
    
        def get_current_traffic_situation(self, start: Location, end: Location) -> Dict:
-           current_time = datetime.now()
-           if (self.cache_timestamp is None or
-               current_time - self.cache_timestamp > self.cache_duration):
-               self.cached_data = self.pipeline.run(
-                   start_location=start,
-                   end_location=end
-               )
-               self.cache_timestamp = current_time
-           return self.cached_data
+           traffic_data = self.pipeline.run(
+               start_location=start,
+               end_location=end
+           )
+           traffic_data['timestamp'] = datetime.now().isoformat()
+           return traffic_data
+
+       def cache_stats(self) -> Dict:
+           return self.cache.snapshot()
+
 #just initialize serivces 
 tomtom = TomTomAPI(TOMTOM_API_KEY)
 traffic_manager = TrafficDataManager(tomtom)
@@ -3,9 +3,14 @@ from pathway.stdlib.ml.index import KNNIndex
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 import json
-import requests
+import math
+import os
 from dataclasses import dataclass
 
+from road_graph import LocalRouter, RoadGraph
+from tomtom_connector import (TIMESTAMP_FORMAT, TOMTOM_BASE_URL, TomTomFlowSubject,
+                              TomTomIncidentSubject, tomtom_client)
+
 # Schema definitions for our data streams
 class TrafficEventSchema(pw.Schema):
     timestamp: str
@@ -22,6 +27,16 @@ class TrafficFlowSchema(pw.Schema):
     congestion_level: int
     free_flow_speed: float
 
+class LiveFlowSchema(TrafficFlowSchema):
+    # where the segment is, so the live feed also provides segment locations
+    latitude: float
+    longitude: float
+
+class SegmentLocationSchema(pw.Schema):
+    segment_id: str
+    latitude: float
+    longitude: float
+
 class RouteSchema(pw.Schema):
     route_id: str
     start_lat: float
@@ -31,19 +46,123 @@ class RouteSchema(pw.Schema):
     estimated_time: int
     distance: float
 
-# Helper functions for TomTom API interactions
-def fetch_traffic_data(api_key: str, bbox: str) -> Dict:
-    base_url = "https://api.tomtom.com/traffic/services/4/flowSegmentData/absolute/10/json"
-    params = {"key": api_key, "bbox": bbox}
-    response = requests.get(base_url, params=params)
-    return response.json()
+KM_PER_DEGREE = 111.32
+
+# segments further than this from every point of a route do not count for it
+SEGMENT_MATCH_RADIUS_KM = 0.5
+SEGMENTS_PER_ROUTE_POINT = 3
+
+def spatial_embedding(lat: float, lon: float) -> tuple:
+    # equirectangular km, so euclidean distance in the KNN index is ground distance
+    return (lat * KM_PER_DEGREE, lon * KM_PER_DEGREE * math.cos(math.radians(lat)))
+
+# geohash precision of the cells events are grouped in; 6 is about 1.2km x 0.6km
+CELL_PRECISION = 6
+
+def _cell_index(value, low: float, span: float, bits: int):
+    index = pw.cast(int, (value - low) / span * (1 << bits))
+    return pw.if_else(index >= (1 << bits), (1 << bits) - 1, index)
+
+def geohash_cell(lat, lon, precision: int = CELL_PRECISION):
+    """
+    Geohash cell of ``lat``/``lon`` as an integer column expression: the
+    geohash bits (longitude first, interleaved) read as one number, so the
+    base32 string of the same cell spells it in 5-bit groups. Built from
+    integer arithmetic, it is evaluated by the engine, not per row in Python,
+    and the cell at a coarser precision ``q`` is ``cell >> 5 * (precision - q)``.
+    """
+    bits = 5 * precision
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    x = _cell_index(lon, -180.0, 360.0, lon_bits)
+    y = _cell_index(lat, -90.0, 180.0, lat_bits)
+    cell = 0
+    for i in range(bits):
+        # bit i from the top alternates longitude (even) and latitude (odd)
+        if i % 2 == 0:
+            bit = (x >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (y >> (lat_bits - 1 - i // 2)) & 1
+        cell = cell + (bit << (bits - 1 - i))
+    return cell
 
 # Real-time traffic processing pipeline
 class TrafficProcessor:
-    def __init__(self, tomtom_api_key: str):
+    """
+    Windowed traffic analysis on event time.
+
+    Events are counted per cell in tumbling ``event_window`` windows,
+    reported as they arrive. Flow is averaged per segment over sliding
+    ``flow_window`` windows every ``flow_hop``, each reported once the
+    newest timestamp passes its end, so a segment always shows the last
+    full ``flow_window``. Rows up to ``allowed_lateness`` behind the newest
+    timestamp still update their window; after that the window is closed,
+    its state dropped and its result retracted, so memory stays bounded on
+    a continuous feed and only each key's latest window is reported.
+
+    With ``live_bbox`` ("minLon,minLat,maxLon,maxLat") flow, incidents and
+    segment locations are polled from TomTom every ``poll_interval_s``
+    instead of read from CSV directories.
+    """
+
+    def __init__(self, tomtom_api_key: str, cell_precision: int = CELL_PRECISION,
+                 event_window: timedelta = timedelta(minutes=15),
+                 flow_window: timedelta = timedelta(minutes=5),
+                 flow_hop: timedelta = timedelta(minutes=1),
+                 allowed_lateness: timedelta = timedelta(minutes=2),
+                 timestamp_format: str = TIMESTAMP_FORMAT,
+                 live_bbox: Optional[str] = None, poll_interval_s: float = 60.0,
+                 tomtom_base_url: str = TOMTOM_BASE_URL):
         self.api_key = tomtom_api_key
-        
-    def build_pipeline(self):
+        self.cell_precision = cell_precision
+        self.event_window = event_window
+        self.flow_window = flow_window
+        self.flow_hop = flow_hop
+        self.allowed_lateness = allowed_lateness
+        self.timestamp_format = timestamp_format
+        self.live_bbox = live_bbox
+        self.poll_interval_s = poll_interval_s
+        self.tomtom_base_url = tomtom_base_url
+
+    def _behavior(self, delay: Optional[timedelta] = None, cutoff: Optional[timedelta] = None):
+        # cutoff works as the watermark: windows ending more than the allowed
+        # lateness before the newest event time are closed and forgotten
+        return pw.temporal.common_behavior(
+            delay=delay, cutoff=cutoff or self.allowed_lateness, keep_results=False
+        )
+
+    def _with_event_time(self, table):
+        return table.with_columns(event_time=pw.this.timestamp.dt.strptime(self.timestamp_format))
+
+    @staticmethod
+    def _latest_window(windows, key):
+        # older windows of a key stay open until the cutoff; report the newest
+        latest = windows.groupby(key).reduce(row=pw.reducers.argmax(pw.this.window_end))
+        return windows.ix(latest.row)
+
+    def _live_inputs(self):
+        api = tomtom_client(self.api_key, base_url=self.tomtom_base_url)
+        traffic_events = pw.io.python.read(
+            TomTomIncidentSubject(api, self.live_bbox, interval_s=self.poll_interval_s,
+                                  timestamp_format=self.timestamp_format),
+            schema=TrafficEventSchema,
+            name="tomtom_incidents"
+        )
+        live_flow = pw.io.python.read(
+            TomTomFlowSubject(api, self.live_bbox, interval_s=self.poll_interval_s,
+                              timestamp_format=self.timestamp_format),
+            schema=LiveFlowSchema,
+            name="tomtom_flow"
+        )
+        traffic_flow = live_flow.without(pw.this.latitude, pw.this.longitude)
+        # segment ids come from their end points, so a segment never moves; keep its first row
+        segment_locations = live_flow.deduplicate(
+            value=pw.this.latitude,
+            instance=pw.this.segment_id,
+            acceptor=lambda new, old: False
+        ).select(pw.this.segment_id, pw.this.latitude, pw.this.longitude)
+        return traffic_events, traffic_flow, segment_locations
+
+    def _csv_inputs(self):
         # Input streams
         traffic_events = pw.io.csv.read(
             "./traffic_events/",
@@ -57,70 +176,43 @@ class TrafficProcessor:
             mode="streaming"
         )
 
-        # Process traffic events
-        filtered_events = traffic_events.filter(
-            traffic_events.severity >= 2  # Filter significant events
-        )
-
-        
-        event_windows = filtered_events.windowby(
-            pw.temporal.minutes(15),
-            timestamp=pw.this.timestamp
-        )
-
-        
-        area_events = event_windows.groupby(
-            lambda x: (round(x.latitude, 2), round(x.longitude, 2))
-        ).reduce(
-            event_count=pw.reducers.count(),
-            max_severity=pw.reducers.max(pw.this.severity),
-            events=pw.reducers.concat_list(pw.this.description)
-        )
-
-        
-        flow_windows = traffic_flow.windowby(
-            pw.temporal.minutes(5),
-            timestamp=pw.this.timestamp
+        # where each flow segment is, so segments can be matched to events and routes.
+        # congestion is joined on it, and a missing directory reads as an empty
+        # table, which would silently produce no analysis and no alerts
+        if not os.path.isdir("./segments/"):
+            raise FileNotFoundError(
+                "./segments/ not found: the CSV pipeline needs segment locations "
+                "(segment_id,latitude,longitude) to place congestion on the map"
+            )
+        segment_locations = pw.io.csv.read(
+            "./segments/",
+            schema=SegmentLocationSchema,
+            mode="streaming"
         )
 
-        congestion_analysis = flow_windows.groupby(
-            pw.this.segment_id
-        ).reduce(
-            avg_speed=pw.reducers.avg(pw.this.speed),
-            congestion_index=pw.reducers.avg(
-                pw.this.speed / pw.this.free_flow_speed
-            ),
-            update_time=pw.reducers.max(pw.this.timestamp)
-        )
+        return traffic_events, traffic_flow, segment_locations
 
-       
-        combined_analysis = congestion_analysis.join(
-            area_events,
-            how="left"
-        ).select(
-            segment_id=pw.this.segment_id,
-            avg_speed=pw.this.avg_speed,
-            congestion_index=pw.this.congestion_index,
-            event_count=pw.coalesce(pw.this.event_count, 0),
-            max_severity=pw.coalesce(pw.this.max_severity, 0),
-            update_time=pw.this.update_time
-        )
+    def build_pipeline(self):
+        if self.live_bbox:
+            combined_analysis = self.build_analysis(*self._live_inputs())
+        else:
+            combined_analysis = self.build_analysis(*self._csv_inputs())
+        return self._build_outputs(combined_analysis)
 
-        
+    def _build_outputs(self, combined_analysis):
         alerts = combined_analysis.filter(
             (pw.this.congestion_index < 0.5) | 
             (pw.this.event_count > 2) |
             (pw.this.max_severity >= 4)
         ).select(
-            alert_type=pw.case(
-                (pw.this.congestion_index < 0.5, "SEVERE_CONGESTION"),
-                (pw.this.event_count > 2, "MULTIPLE_INCIDENTS"),
-                (pw.this.max_severity >= 4, "CRITICAL_EVENT")
+            alert_type=pw.if_else(
+                pw.this.congestion_index < 0.5, "SEVERE_CONGESTION",
+                pw.if_else(pw.this.event_count > 2, "MULTIPLE_INCIDENTS", "CRITICAL_EVENT")
             ),
             segment_id=pw.this.segment_id,
-            details=pw.concat(
-                "Congestion: ", pw.cast(str, pw.this.congestion_index),
-                ", Events: ", pw.cast(str, pw.this.event_count)
+            details=(
+                "Congestion: " + pw.cast(str, pw.this.congestion_index)
+                + ", Events: " + pw.cast(str, pw.this.event_count)
             ),
             timestamp=pw.this.update_time
         )
@@ -139,10 +231,165 @@ class TrafficProcessor:
 
         return combined_analysis, alerts
 
+    def build_analysis(self, traffic_events, traffic_flow, segment_locations):
+        # Process traffic events
+        filtered_events = self._with_event_time(traffic_events).filter(
+            pw.this.severity >= 2  # Filter significant events
+        ).with_columns(
+            cell=geohash_cell(pw.this.latitude, pw.this.longitude, self.cell_precision)
+        )
+
+        # segment -> cell, computed once per segment location update
+        segment_cells = segment_locations.select(
+            pw.this.segment_id,
+            pw.this.latitude,
+            pw.this.longitude,
+            cell=geohash_cell(pw.this.latitude, pw.this.longitude, self.cell_precision)
+        )
+
+        event_windows = filtered_events.windowby(
+            pw.this.event_time,
+            window=pw.temporal.tumbling(duration=self.event_window),
+            behavior=self._behavior(),
+            instance=pw.this.cell
+        ).reduce(
+            cell=pw.this._pw_instance,
+            window_end=pw.this._pw_window_end,
+            event_count=pw.reducers.count(),
+            max_severity=pw.reducers.max(pw.this.severity),
+            events=pw.reducers.tuple(pw.this.description)
+        )
+        area_events = self._latest_window(event_windows, pw.this.cell)
+
+        flow_windows = self._with_event_time(traffic_flow).windowby(
+            pw.this.event_time,
+            window=pw.temporal.sliding(hop=self.flow_hop, duration=self.flow_window),
+            # a window shows up once complete and must outlive the hop, or a
+            # segment would drop out until the next window completes
+            behavior=self._behavior(
+                delay=self.flow_window, cutoff=max(self.allowed_lateness, self.flow_hop)
+            ),
+            instance=pw.this.segment_id
+        ).reduce(
+            segment_id=pw.this._pw_instance,
+            window_end=pw.this._pw_window_end,
+            avg_speed=pw.reducers.avg(pw.this.speed),
+            congestion_index=pw.reducers.avg(
+                pw.this.speed / pw.this.free_flow_speed
+            ),
+            update_time=pw.reducers.max(pw.this.event_time)
+        )
+        congestion_analysis = self._latest_window(flow_windows, pw.this.segment_id)
+
+        located_congestion = congestion_analysis.join(
+            segment_cells,
+            pw.left.segment_id == pw.right.segment_id
+        ).select(
+            segment_id=pw.left.segment_id,
+            avg_speed=pw.left.avg_speed,
+            congestion_index=pw.left.congestion_index,
+            update_time=pw.left.update_time,
+            latitude=pw.right.latitude,
+            longitude=pw.right.longitude,
+            cell=pw.right.cell
+        )
+
+        # each segment only meets the events of its own cell, not every event
+        return located_congestion.join_left(
+            area_events,
+            pw.left.cell == pw.right.cell
+        ).select(
+            segment_id=pw.left.segment_id,
+            latitude=pw.left.latitude,
+            longitude=pw.left.longitude,
+            cell=pw.left.cell,
+            avg_speed=pw.left.avg_speed,
+            congestion_index=pw.left.congestion_index,
+            event_count=pw.coalesce(pw.right.event_count, 0),
+            max_severity=pw.coalesce(pw.right.max_severity, 0),
+            update_time=pw.left.update_time
+        )
+
 class SmartRoutingEngine:
-    def __init__(self, traffic_analysis):
+    def __init__(self, traffic_analysis, road_graph: Optional[RoadGraph] = None):
         self.traffic_analysis = traffic_analysis
-        
+        # with a road graph, ETAs come from a local shortest path over live
+        # congestion instead of scaling the requested estimate
+        self.router = LocalRouter(road_graph) if road_graph is not None else None
+
+    def _follow_congestion(self):
+        router = self.router
+
+        def on_change(key, row, time, is_addition):
+            # a retraction is followed by the addition carrying the new value
+            if is_addition:
+                router.set_congestion(row["segment_id"], row["congestion_index"])
+
+        pw.io.subscribe(self.traffic_analysis, on_change=on_change, name="road_graph_congestion")
+
+    def _local_eta(self, start_lat, start_lon, end_lat, end_lon) -> Optional[float]:
+        try:
+            return self.router.eta(start_lat, start_lon, end_lat, end_lon)
+        except Exception as e:
+            print(f"Local routing failed: {str(e)}")
+            return None
+
+    def _match_segments(self, route_requests):
+        """
+        Per route: the worst congestion and the events of the segments near its
+        start, midpoint and end, found with a KNN index over segment locations.
+        Matches are kept up to date as segments and routes change.
+        """
+        segments = self.traffic_analysis.with_columns(
+            embedding=pw.apply_with_type(spatial_embedding, tuple, pw.this.latitude, pw.this.longitude)
+        )
+        index = KNNIndex(segments.embedding, segments, n_dimensions=2, bucket_length=2 * SEGMENT_MATCH_RADIUS_KM)
+
+        route_points = pw.Table.concat_reindex(
+            route_requests.select(pw.this.route_id, lat=pw.this.start_lat, lon=pw.this.start_lon),
+            route_requests.select(
+                pw.this.route_id,
+                lat=(pw.this.start_lat + pw.this.end_lat) / 2,
+                lon=(pw.this.start_lon + pw.this.end_lon) / 2
+            ),
+            route_requests.select(pw.this.route_id, lat=pw.this.end_lat, lon=pw.this.end_lon),
+        ).with_columns(
+            embedding=pw.apply_with_type(spatial_embedding, tuple, pw.this.lat, pw.this.lon)
+        )
+
+        matches = index.get_nearest_items(
+            route_points.embedding, k=SEGMENTS_PER_ROUTE_POINT, collapse_rows=False, with_distances=True
+        )
+        # the index reports squared distances; unmatched points come back empty
+        near = matches.filter(
+            pw.coalesce(pw.this.dist, math.inf) <= SEGMENT_MATCH_RADIUS_KM ** 2
+        ).join(
+            route_points,
+            pw.left.query_id == pw.right.id
+        ).select(
+            route_id=pw.right.route_id,
+            # matched rows always carry the segment's values
+            segment_id=pw.unwrap(pw.left.segment_id),
+            cell=pw.unwrap(pw.left.cell),
+            congestion_index=pw.unwrap(pw.left.congestion_index),
+            event_count=pw.unwrap(pw.left.event_count),
+            max_severity=pw.unwrap(pw.left.max_severity)
+        )
+
+        # event counts are per cell, so segments sharing a cell count its events once
+        route_cells = near.groupby(pw.this.route_id, pw.this.cell).reduce(
+            pw.this.route_id,
+            congestion_index=pw.reducers.min(pw.this.congestion_index),
+            event_count=pw.reducers.max(pw.this.event_count),
+            max_severity=pw.reducers.max(pw.this.max_severity)
+        )
+        return route_cells.groupby(pw.this.route_id).reduce(
+            pw.this.route_id,
+            congestion_index=pw.reducers.min(pw.this.congestion_index),
+            event_count=pw.reducers.sum(pw.this.event_count),
+            max_severity=pw.reducers.max(pw.this.max_severity)
+        )
+
     def build_routing_pipeline(self):
         # Input stream for route requests
         route_requests = pw.io.csv.read(
@@ -151,25 +398,43 @@ class SmartRoutingEngine:
             mode="streaming"
         )
 
+        if self.router is not None:
+            self._follow_congestion()
+            route_requests = route_requests.with_columns(
+                local_eta=pw.apply_with_type(
+                    self._local_eta, Optional[float],
+                    pw.this.start_lat, pw.this.start_lon, pw.this.end_lat, pw.this.end_lon
+                )
+            )
+        else:
+            route_requests = route_requests.with_columns(local_eta=pw.cast(Optional[float], None))
+
         # Join route segments with traffic analysis
-        route_with_traffic = route_requests.join(
-            self.traffic_analysis,
-            how="left"
+        route_traffic = self._match_segments(route_requests)
+        route_with_traffic = route_requests.join_left(
+            route_traffic,
+            pw.left.route_id == pw.right.route_id
+        ).select(
+            *pw.left,
+            # routes with no segment nearby count as free-flowing
+            congestion_index=pw.coalesce(pw.right.congestion_index, 1.0),
+            event_count=pw.coalesce(pw.right.event_count, 0),
+            max_severity=pw.coalesce(pw.right.max_severity, 0)
         )
 
         # Calculate optimal routes
         optimized_routes = route_with_traffic.select(
             route_id=pw.this.route_id,
-            adjusted_time=pw.this.estimated_time * (
-                1 + pw.coalesce(1 - pw.this.congestion_index, 0)
+            adjusted_time=pw.coalesce(
+                pw.this.local_eta,
+                pw.this.estimated_time * (2 - pw.this.congestion_index)
             ),
-            risk_score=pw.case(
-                (pw.this.max_severity >= 4, 1.0),
-                (pw.this.max_severity >= 2, 0.5),
-                default=0.0
+            risk_score=pw.if_else(
+                pw.this.max_severity >= 4, 1.0,
+                pw.if_else(pw.this.max_severity >= 2, 0.5, 0.0)
             ),
             alternative_needed=(
-                pw.this.congestion_index < 0.6 |
+                (pw.this.congestion_index < 0.6) |
                 (pw.this.event_count > 1)
             )
         )
@@ -177,10 +442,9 @@ class SmartRoutingEngine:
         # Generate route recommendations
         recommendations = optimized_routes.select(
             route_id=pw.this.route_id,
-            recommendation=pw.case(
-                (pw.this.alternative_needed, "FIND_ALTERNATIVE"),
-                (pw.this.risk_score > 0.5, "CAUTION_ADVISED"),
-                default="ROUTE_OK"
+            recommendation=pw.if_else(
+                pw.this.alternative_needed, "FIND_ALTERNATIVE",
+                pw.if_else(pw.this.risk_score > 0.5, "CAUTION_ADVISED", "ROUTE_OK")
             ),
             adjusted_eta=pw.this.adjusted_time,
             risk_level=pw.this.risk_score
@@ -192,11 +456,19 @@ class SmartRoutingEngine:
 
 def main():
     # Initialize the pipeline
-    processor = TrafficProcessor("your-tomtom-api-key")
+    # with TRAFFIC_BBOX set, poll TomTom (or TOMTOM_BASE_URL, e.g. mock_tomtom.py) instead of reading CSVs
+    processor = TrafficProcessor(
+        os.getenv("TOMTOM_API_KEY", ""),
+        live_bbox=os.getenv("TRAFFIC_BBOX"),
+        poll_interval_s=float(os.getenv("TRAFFIC_POLL_INTERVAL", "60")),
+        tomtom_base_url=os.getenv("TOMTOM_BASE_URL", TOMTOM_BASE_URL)
+    )
     traffic_analysis, alerts = processor.build_pipeline()
     
-    # Initialize routing engine
-    routing_engine = SmartRoutingEngine(traffic_analysis)
+    # Initialize routing engine, with local routing when a road graph is available
+    road_graph_path = os.getenv("ROAD_GRAPH_PATH")
+    road_graph = RoadGraph.load(road_graph_path) if road_graph_path else None
+    routing_engine = SmartRoutingEngine(traffic_analysis, road_graph)
     recommendations = routing_engine.build_routing_pipeline()
     
     # Run the pipeline
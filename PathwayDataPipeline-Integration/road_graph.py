@@ -0,0 +1,548 @@
+import heapq
+import math
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+# a segment reported at this speed ratio or below is treated as crawling, not
+# blocked, so a bad reading cannot make an edge infinitely expensive
+MIN_CONGESTION_INDEX = 0.05
+
+INF = math.inf
+
+
+@dataclass
+class LocalRoute:
+    travel_time_s: float
+    length_m: float
+    nodes: List[int]
+    edges: List[int]
+    segment_ids: List[str]
+
+    def to_dict(self):
+        return {
+            "travel_time_s": round(self.travel_time_s, 1),
+            "length_m": round(self.length_m, 1),
+            "segment_ids": self.segment_ids,
+        }
+
+
+class RoadGraph:
+    """
+    Directed road graph in CSR form, with free-flow and live edge weights.
+
+    Edge ``e`` runs from ``sources[e]`` to ``targets[e]``; the outgoing edges
+    of node ``n`` are ``indptr[n]:indptr[n + 1]``. Weights are travel times in
+    seconds: ``free_flow_s`` from length and speed limit, ``weight`` after the
+    latest congestion update of each edge's ``segment_id`` (the TomTom flow
+    segment it belongs to). Build one with ``from_edges`` (e.g. from an OSM
+    extract) and keep it as a .npz with ``save``/``load``. ``order`` is an
+    optional precomputed contraction order (e.g. nested dissection from
+    METIS/InertialFlow) saved along with the graph; ``LocalRouter`` only
+    builds a contraction hierarchy when one is present.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, indptr: np.ndarray, targets: np.ndarray,
+                 length_m: np.ndarray, free_flow_s: np.ndarray, segment_ids: Sequence[str],
+                 order: Optional[Sequence[int]] = None):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int64)
+        self.length_m = np.asarray(length_m, dtype=float)
+        self.free_flow_s = np.asarray(free_flow_s, dtype=float)
+        self.segment_ids = list(segment_ids)
+        self.order = np.asarray(order, dtype=np.int64) if order is not None else None
+        self.weight = self.free_flow_s.copy()
+        self.sources = np.repeat(np.arange(len(self.lat)), np.diff(self.indptr))
+
+        # incoming edges per node, for backward searches
+        order = np.argsort(self.targets, kind="stable")
+        self.rev_edges = order
+        self.rev_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.targets, minlength=len(self.lat)))))
+
+        self._segment_edges: Dict[str, List[int]] = {}
+        for e, segment_id in enumerate(self.segment_ids):
+            if segment_id:
+                self._segment_edges.setdefault(segment_id, []).append(e)
+
+        # fastest free-flow speed over the straight line between edge ends, so
+        # the A* heuristic never overestimates even where lengths are rounded
+        kx = np.cos(np.radians(self.lat[self.sources]))
+        straight_m = np.radians(np.hypot((self.lon[self.targets] - self.lon[self.sources]) * kx,
+                                         self.lat[self.targets] - self.lat[self.sources])) * EARTH_RADIUS_M
+        speeds = np.maximum(self.length_m, straight_m) / np.where(self.free_flow_s > 0, self.free_flow_s, INF)
+        self.max_speed_mps = float(speeds.max()) if len(speeds) and speeds.max() > 0 else 1.0
+
+        # plain lists are much faster than numpy scalars in the search loops
+        self._indptr = self.indptr.tolist()
+        self._targets = self.targets.tolist()
+        self._sources = self.sources.tolist()
+        self._rev_indptr = self.rev_indptr.tolist()
+        self._rev_edges = self.rev_edges.tolist()
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.lat)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.targets)
+
+    @classmethod
+    def from_edges(cls, nodes: Sequence[Tuple[float, float]],
+                   edges: Iterable[Tuple[int, int, float, float, str]]) -> "RoadGraph":
+        """``nodes`` as ``(lat, lon)``; ``edges`` as ``(source, target, length_m, speed_kmh, segment_id)``."""
+        edges = sorted(edges, key=lambda e: e[0])
+        nodes = np.asarray(nodes, dtype=float).reshape(-1, 2)
+        sources = np.array([e[0] for e in edges], dtype=np.int64)
+        length = np.array([e[2] for e in edges], dtype=float)
+        speed = np.array([e[3] for e in edges], dtype=float) / 3.6
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=len(nodes)))))
+        return cls(nodes[:, 0], nodes[:, 1], indptr, [e[1] for e in edges], length,
+                   length / np.maximum(speed, 0.1), [e[4] or "" for e in edges])
+
+    def save(self, path: str):
+        arrays = dict(lat=self.lat, lon=self.lon, indptr=self.indptr, targets=self.targets,
+                      length_m=self.length_m, free_flow_s=self.free_flow_s,
+                      segment_ids=np.array(self.segment_ids, dtype=str))
+        if self.order is not None:
+            arrays["order"] = self.order
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "RoadGraph":
+        data = np.load(path)
+        return cls(data["lat"], data["lon"], data["indptr"], data["targets"], data["length_m"],
+                   data["free_flow_s"], data["segment_ids"].tolist(),
+                   data["order"] if "order" in data.files else None)
+
+    def nearest_node(self, lat: float, lon: float) -> int:
+        kx = math.cos(math.radians(lat))
+        return int(np.argmin(((self.lon - lon) * kx) ** 2 + (self.lat - lat) ** 2))
+
+    def _distance_m(self, a: int, b: int) -> float:
+        kx = math.cos(math.radians(self.lat[a]))
+        dx = (self.lon[b] - self.lon[a]) * kx
+        dy = self.lat[b] - self.lat[a]
+        return math.radians(math.hypot(dx, dy)) * EARTH_RADIUS_M
+
+    def set_congestion(self, segment_id: str, congestion_index: float) -> List[int]:
+        """
+        Scale the segment's edges to ``free_flow / congestion_index`` (the
+        index is speed over free-flow speed). Returns the edges whose weight changed.
+        """
+        ratio = min(1.0, max(MIN_CONGESTION_INDEX, float(congestion_index)))
+        changed = []
+        for e in self._segment_edges.get(segment_id, ()):
+            weight = self.free_flow_s[e] / ratio
+            if weight != self.weight[e]:
+                self.weight[e] = weight
+                changed.append(e)
+        return changed
+
+    # -- searches on the full graph --
+
+    def astar(self, source: int, target: int, weight: Optional[Sequence[float]] = None) -> Tuple[float, List[int]]:
+        """Cost and edge list of the shortest path, with a straight-line-at-top-speed heuristic."""
+        weight = self.weight.tolist() if weight is None else list(weight)
+        indptr, targets = self._indptr, self._targets
+        h_cache: Dict[int, float] = {}
+
+        def h(n):
+            if n not in h_cache:
+                h_cache[n] = self._distance_m(n, target) / self.max_speed_mps
+            return h_cache[n]
+
+        dist = {source: 0.0}
+        parent: Dict[int, int] = {}
+        heap = [(h(source), 0.0, source)]
+        while heap:
+            _, d, node = heapq.heappop(heap)
+            if node == target:
+                return d, self._edges_to(parent, source, target)
+            if d > dist.get(node, INF):
+                continue
+            for e in range(indptr[node], indptr[node + 1]):
+                nd = d + weight[e]
+                v = targets[e]
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    parent[v] = e
+                    heapq.heappush(heap, (nd + h(v), nd, v))
+        return INF, []
+
+    def bidirectional_dijkstra(self, source: int, target: int,
+                               weight: Optional[Sequence[float]] = None) -> Tuple[float, List[int]]:
+        weight = self.weight.tolist() if weight is None else list(weight)
+        if source == target:
+            return 0.0, []
+        dist = [{source: 0.0}, {target: 0.0}]
+        parent: List[Dict[int, int]] = [{}, {}]
+        heaps = [[(0.0, source)], [(0.0, target)]]
+        settled = [set(), set()]
+        best, meet = INF, None
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            d, node = heapq.heappop(heaps[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+            if side == 0:
+                edges = range(self._indptr[node], self._indptr[node + 1])
+                ends = self._targets
+            else:
+                edges = (self._rev_edges[i] for i in range(self._rev_indptr[node], self._rev_indptr[node + 1]))
+                ends = self._sources
+            for e in edges:
+                v = ends[e]
+                nd = d + weight[e]
+                if nd < dist[side].get(v, INF):
+                    dist[side][v] = nd
+                    parent[side][v] = e
+                    heapq.heappush(heaps[side], (nd, v))
+                if v in dist[1 - side] and nd + dist[1 - side][v] < best:
+                    best, meet = nd + dist[1 - side][v], v
+        if meet is None:
+            return INF, []
+        forward = self._edges_to(parent[0], source, meet)
+        backward = []
+        node = meet
+        while node != target:
+            e = parent[1][node]
+            backward.append(e)
+            node = self._targets[e]
+        return best, forward + backward
+
+    def _edges_to(self, parent: Dict[int, int], source: int, target: int) -> List[int]:
+        edges = []
+        node = target
+        while node != source:
+            e = parent[node]
+            edges.append(e)
+            node = self._sources[e]
+        edges.reverse()
+        return edges
+
+    def describe(self, edges: List[int], weight: Optional[np.ndarray] = None) -> LocalRoute:
+        weight = self.weight if weight is None else weight
+        nodes = [self._sources[edges[0]]] + [self._targets[e] for e in edges] if edges else []
+        segments = []
+        for e in edges:
+            segment_id = self.segment_ids[e]
+            if segment_id and (not segments or segments[-1] != segment_id):
+                segments.append(segment_id)
+        return LocalRoute(float(sum(weight[e] for e in edges)), float(sum(self.length_m[e] for e in edges)),
+                          nodes, list(edges), segments)
+
+
+class CustomizableContractionHierarchy:
+    """
+    Customizable contraction hierarchy (CCH) over a ``RoadGraph``.
+
+    Preprocessing only depends on the graph's shape: nodes are ordered
+    (greedy minimum degree unless an ``order`` is given, e.g. from nested
+    dissection; the greedy order adds far too many shortcuts beyond a few
+    thousand nodes) and contracted, adding a shortcut between every pair of
+    higher neighbors. Customization then fills shortcut weights from the
+    live edge weights, bottom-up over the lower triangles of each arc. When
+    a few edges change, ``update`` re-customizes only the arcs that depend
+    on them, so congestion updates cost far less than a rebuild. Queries are
+    two upward Dijkstra searches over the small hierarchy.
+    """
+
+    def __init__(self, graph: RoadGraph, order: Optional[Sequence[int]] = None):
+        self.graph = graph
+        self.order = list(order) if order is not None else self._min_degree_order()
+        self.rank = [0] * graph.num_nodes
+        for r, node in enumerate(self.order):
+            self.rank[node] = r
+        self._contract()
+        self._assign_edges()
+        self.customize()
+
+    def _undirected_neighbors(self) -> List[set]:
+        g = self.graph
+        neighbors = [set() for _ in range(g.num_nodes)]
+        for u, v in zip(g._sources, g._targets):
+            if u != v:
+                neighbors[u].add(v)
+                neighbors[v].add(u)
+        return neighbors
+
+    def _min_degree_order(self) -> List[int]:
+        neighbors = self._undirected_neighbors()
+        heap = [(len(n), node) for node, n in enumerate(neighbors)]
+        heapq.heapify(heap)
+        contracted = [False] * len(neighbors)
+        order = []
+        while heap:
+            degree, node = heapq.heappop(heap)
+            if contracted[node] or degree != len(neighbors[node]):
+                continue
+            contracted[node] = True
+            order.append(node)
+            around = neighbors[node]
+            for v in around:
+                neighbors[v].discard(node)
+                neighbors[v].update(w for w in around if w != v)
+                heapq.heappush(heap, (len(neighbors[v]), v))
+        return order
+
+    def _contract(self):
+        rank = self.rank
+        neighbors = self._undirected_neighbors()
+        upper = [sorted((v for v in neighbors[u] if rank[v] > rank[u]), key=rank.__getitem__)
+                 for u in range(len(neighbors))]
+        # eliminating u connects all of its higher neighbors
+        for u in self.order:
+            around = upper[u]
+            for i, v in enumerate(around):
+                for w in around[i + 1:]:
+                    if w not in neighbors[v]:
+                        neighbors[v].add(w)
+                        neighbors[w].add(v)
+                        upper[v].append(w)
+            # keep lists sorted for the nodes still to be processed
+            for v in around:
+                upper[v].sort(key=rank.__getitem__)
+
+        # arcs run from the lower to the higher ranked end; up = low->high, down = high->low
+        self.arc_low: List[int] = []
+        self.arc_high: List[int] = []
+        self.up_arcs: List[List[int]] = [[] for _ in range(len(neighbors))]
+        arc_of: Dict[Tuple[int, int], int] = {}
+        for u in self.order:
+            for v in upper[u]:
+                arc_of[(u, v)] = len(self.arc_low)
+                self.up_arcs[u].append(len(self.arc_low))
+                self.arc_low.append(u)
+                self.arc_high.append(v)
+        self.arc_of = arc_of
+
+        # lower triangles (u below v < w): arc (v, w) is at most (v->u) + (u->w)
+        self.triangles: List[List[Tuple[int, int, int]]] = [[] for _ in self.arc_low]
+        self.dependents: List[List[int]] = [[] for _ in self.arc_low]
+        for u in self.order:
+            around = upper[u]
+            for i, v in enumerate(around):
+                for w in around[i + 1:]:
+                    arc, b, c = arc_of[(v, w)], arc_of[(u, v)], arc_of[(u, w)]
+                    self.triangles[arc].append((b, c, u))
+                    self.dependents[b].append(arc)
+                    self.dependents[c].append(arc)
+
+    def _assign_edges(self):
+        g = self.graph
+        self.arc_edges: List[List[Tuple[int, bool]]] = [[] for _ in self.arc_low]
+        self.edge_arc: List[int] = []
+        for e, (u, v) in enumerate(zip(g._sources, g._targets)):
+            if u == v:
+                self.edge_arc.append(-1)
+                continue
+            low, high = (u, v) if self.rank[u] < self.rank[v] else (v, u)
+            arc = self.arc_of[(low, high)]
+            self.arc_edges[arc].append((e, u == low))
+            self.edge_arc.append(arc)
+
+    def _input_weights(self, arc: int, weight: List[float]) -> Tuple[float, float, int, int]:
+        up = down = INF
+        up_edge = down_edge = -1
+        for e, is_up in self.arc_edges[arc]:
+            if is_up and weight[e] < up:
+                up, up_edge = weight[e], e
+            elif not is_up and weight[e] < down:
+                down, down_edge = weight[e], e
+        return up, down, up_edge, down_edge
+
+    def _customize_arc(self, arc: int, weight: List[float]) -> bool:
+        up, down, up_edge, down_edge = self._input_weights(arc, weight)
+        up_via = down_via = -1
+        for b, c, u in self.triangles[arc]:
+            if self.down[b] + self.up[c] < up:
+                up, up_via = self.down[b] + self.up[c], u
+            if self.down[c] + self.up[b] < down:
+                down, down_via = self.down[c] + self.up[b], u
+        changed = up != self.up[arc] or down != self.down[arc]
+        self.up[arc], self.down[arc] = up, down
+        self.up_via[arc], self.down_via[arc] = up_via if up_via >= 0 else -1 - up_edge, \
+            down_via if down_via >= 0 else -1 - down_edge
+        return changed
+
+    def customize(self):
+        """Compute every arc weight from the graph's current edge weights."""
+        n = len(self.arc_low)
+        self.up, self.down = [INF] * n, [INF] * n
+        # via >= 0: shortcut over that node; via < 0: original edge -1 - via
+        self.up_via, self.down_via = [-1] * n, [-1] * n
+        weight = self.graph.weight.tolist()
+        for arc in range(n):
+            # arcs were created in rank order of their lower end, so triangles are ready
+            self._customize_arc(arc, weight)
+
+    def update(self, edges: Iterable[int]) -> int:
+        """Re-customize after ``edges`` changed weight; returns how many arcs were recomputed."""
+        weight = self.graph.weight.tolist()
+        heap = list({(self.rank[self.arc_low[a]], a) for a in (self.edge_arc[e] for e in edges) if a >= 0})
+        heapq.heapify(heap)
+        queued = {a for _, a in heap}
+        recomputed = 0
+        while heap:
+            _, arc = heapq.heappop(heap)
+            queued.discard(arc)
+            recomputed += 1
+            if self._customize_arc(arc, weight):
+                for dependent in self.dependents[arc]:
+                    if dependent not in queued:
+                        queued.add(dependent)
+                        heapq.heappush(heap, (self.rank[self.arc_low[dependent]], dependent))
+        return recomputed
+
+    def _upward_search(self, source: int, weights: List[float]) -> Tuple[Dict[int, float], Dict[int, int]]:
+        dist = {source: 0.0}
+        parent: Dict[int, int] = {}
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            for arc in self.up_arcs[node]:
+                v = self.arc_high[arc]
+                nd = d + weights[arc]
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    parent[v] = arc
+                    heapq.heappush(heap, (nd, v))
+        return dist, parent
+
+    def query(self, source: int, target: int) -> Tuple[float, List[int]]:
+        """Cost and edge list of the shortest path under the customized weights."""
+        if source == target:
+            return 0.0, []
+        forward, forward_parent = self._upward_search(source, self.up)
+        backward, backward_parent = self._upward_search(target, self.down)
+        best, meet = INF, None
+        for node, d in forward.items():
+            total = d + backward.get(node, INF)
+            if total < best:
+                best, meet = total, node
+        if meet is None:
+            return INF, []
+
+        edges: List[int] = []
+        climb = []
+        node = meet
+        while node != source:
+            arc = forward_parent[node]
+            climb.append(arc)
+            node = self.arc_low[arc]
+        for arc in reversed(climb):
+            self._unpack(arc, True, edges)
+        node = meet
+        while node != target:
+            arc = backward_parent[node]
+            self._unpack(arc, False, edges)
+            node = self.arc_low[arc]
+        return best, edges
+
+    def _unpack(self, arc: int, up: bool, edges: List[int]):
+        via = self.up_via[arc] if up else self.down_via[arc]
+        if via < 0:
+            edges.append(-1 - via)
+            return
+        low, high = self.arc_low[arc], self.arc_high[arc]
+        b, c = self.arc_of[(via, low)], self.arc_of[(via, high)]
+        if up:
+            # low -> via -> high
+            self._unpack(b, False, edges)
+            self._unpack(c, True, edges)
+        else:
+            # high -> via -> low
+            self._unpack(c, False, edges)
+            self._unpack(b, True, edges)
+
+
+class LocalRouter:
+    """
+    Thread-safe routing over a ``RoadGraph`` with live congestion.
+
+    Congestion updates (``set_congestion``, e.g. from the Pathway
+    congestion stream) are queued and applied before the next query: edge
+    weights first, then an incremental re-customization of the hierarchy.
+    ``route`` returns the best path plus alternatives found by penalizing
+    the edges of the routes already found.
+
+    The hierarchy is only built when a contraction order is available
+    (``order`` or ``graph.order``); otherwise queries run a bidirectional
+    Dijkstra on the graph, which is fast enough for city-sized graphs and
+    has nothing to re-customize. ``use_hierarchy`` overrides that choice.
+    """
+
+    def __init__(self, graph: RoadGraph, use_hierarchy: Optional[bool] = None,
+                 order: Optional[Sequence[int]] = None):
+        self.graph = graph
+        if order is None:
+            order = graph.order
+        if use_hierarchy is None:
+            use_hierarchy = order is not None
+        self.hierarchy = CustomizableContractionHierarchy(graph, order) if use_hierarchy else None
+        self._pending: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def set_congestion(self, segment_id: str, congestion_index: float):
+        with self._lock:
+            self._pending[segment_id] = congestion_index
+
+    def _apply_pending(self):
+        # caller holds self._lock
+        if not self._pending:
+            return
+        changed = []
+        for segment_id, congestion_index in self._pending.items():
+            changed.extend(self.graph.set_congestion(segment_id, congestion_index))
+        self._pending.clear()
+        if changed and self.hierarchy is not None:
+            self.hierarchy.update(changed)
+
+    def route(self, start_lat: float, start_lon: float, end_lat: float, end_lon: float,
+              alternatives: int = 0, penalty: float = 1.4, max_overlap: float = 0.8) -> List[LocalRoute]:
+        with self._lock:
+            self._apply_pending()
+            source = self.graph.nearest_node(start_lat, start_lon)
+            target = self.graph.nearest_node(end_lat, end_lon)
+            if self.hierarchy is not None:
+                cost, edges = self.hierarchy.query(source, target)
+            else:
+                cost, edges = self.graph.bidirectional_dijkstra(source, target)
+            if cost == INF:
+                return []
+            routes = [self.graph.describe(edges)]
+
+            weight = self.graph.weight.copy()
+            for _ in range(alternatives * 2):
+                if len(routes) > alternatives:
+                    break
+                weight[routes[-1].edges] *= penalty
+                cost, edges = self.graph.astar(source, target, weight)
+                if cost == INF:
+                    break
+                candidate = self.graph.describe(edges)
+                # keep it only if it is really a different way
+                if all(self._overlap(candidate, r) <= max_overlap for r in routes):
+                    routes.append(candidate)
+            return routes[:1] + sorted(routes[1:], key=lambda r: r.travel_time_s)
+
+    def eta(self, start_lat: float, start_lon: float, end_lat: float, end_lon: float) -> Optional[float]:
+        routes = self.route(start_lat, start_lon, end_lat, end_lon)
+        return routes[0].travel_time_s if routes else None
+
+    def _overlap(self, a: LocalRoute, b: LocalRoute) -> float:
+        shared = set(a.edges) & set(b.edges)
+        total = a.length_m or 1.0
+        return float(sum(self.graph.length_m[e] for e in shared)) / total
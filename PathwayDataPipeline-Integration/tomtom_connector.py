@@ -0,0 +1,220 @@
+import hashlib
+import math
+import os
+import sys
+import threading
+import time
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import pathway as pw
+
+# shared helpers (TomTom client, scheduler, ...) live next to main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import TOMTOM_BASE_URL, TomTomAPI, TomTomAPIError, TrafficIncident
+from scheduler import BACKGROUND, RequestScheduler
+
+KM_PER_DEGREE = 111.32
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# TomTom caps incidentDetails at 10,000 km2 per request; tiles stay well below
+DEFAULT_TILE_KM = 10.0
+# flow is per road segment around a point, so the city is sampled on a grid
+DEFAULT_FLOW_SPACING_KM = 1.0
+
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    """``"minLon,minLat,maxLon,maxLat"`` (TomTom's order) as floats."""
+    min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise ValueError(f"empty bbox: {bbox}")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _steps(low: float, high: float, step: float) -> List[float]:
+    count = max(1, math.ceil((high - low) / step - 1e-9))
+    return [low + i * (high - low) / count for i in range(count + 1)]
+
+
+def tile_bbox(bbox: str, tile_km: float = DEFAULT_TILE_KM) -> List[str]:
+    """Split ``bbox`` into tiles of at most ``tile_km`` a side, in the same string format."""
+    min_lon, min_lat, max_lon, max_lat = parse_bbox(bbox)
+    lat_step = tile_km / KM_PER_DEGREE
+    lon_step = tile_km / (KM_PER_DEGREE * math.cos(math.radians((min_lat + max_lat) / 2)))
+    lats, lons = _steps(min_lat, max_lat, lat_step), _steps(min_lon, max_lon, lon_step)
+    return [f"{lons[j]:.6f},{lats[i]:.6f},{lons[j + 1]:.6f},{lats[i + 1]:.6f}"
+            for i in range(len(lats) - 1) for j in range(len(lons) - 1)]
+
+
+def flow_points(bbox: str, spacing_km: float = DEFAULT_FLOW_SPACING_KM) -> List[Tuple[float, float]]:
+    """Centers of a ``spacing_km`` grid over ``bbox``, as ``(lat, lon)``."""
+    min_lon, min_lat, max_lon, max_lat = parse_bbox(bbox)
+    lat_step = spacing_km / KM_PER_DEGREE
+    lon_step = spacing_km / (KM_PER_DEGREE * math.cos(math.radians((min_lat + max_lat) / 2)))
+    lats, lons = _steps(min_lat, max_lat, lat_step), _steps(min_lon, max_lon, lon_step)
+    return [((lats[i] + lats[i + 1]) / 2, (lons[j] + lons[j + 1]) / 2)
+            for i in range(len(lats) - 1) for j in range(len(lons) - 1)]
+
+
+def segment_id(coordinates: List[List[float]]) -> str:
+    # TomTom flow has no segment id; the segment's end points identify it
+    (lat1, lon1), (lat2, lon2) = coordinates[0], coordinates[-1]
+    return hashlib.sha1(f"{lat1:.5f},{lon1:.5f}:{lat2:.5f},{lon2:.5f}".encode()).hexdigest()[:16]
+
+
+def congestion_level(speed: float, free_flow_speed: float) -> int:
+    """0 (free flow) to 4 (standstill) from the speed ratio."""
+    ratio = speed / free_flow_speed if free_flow_speed else 1.0
+    for level, threshold in enumerate((0.85, 0.65, 0.45, 0.25)):
+        if ratio >= threshold:
+            return level
+    return 4
+
+
+class _PollingSubject(pw.io.python.ConnectorSubject):
+    """
+    Polls every ``interval_s`` and emits rows that are new or changed since
+    they were last emitted; an unchanged row is re-emitted after
+    ``refresh_s`` so windows downstream keep seeing ongoing conditions.
+    Rows are append-only observations stamped with the poll time, so the
+    pipeline's event-time windows age them out. Subclasses implement ``_fetch``
+    (ConnectorSubject is an ABC, so a subclass without it cannot be created).
+    """
+
+    def __init__(self, api: TomTomAPI, interval_s: float, refresh_s: float, workers: int,
+                 timestamp_format: str, max_polls: Optional[int]):
+        super().__init__()
+        self.api = api
+        self.interval_s = interval_s
+        self.refresh_s = refresh_s
+        self.workers = workers
+        self.timestamp_format = timestamp_format
+        self.max_polls = max_polls
+        # key -> (compared values, time last emitted)
+        self._emitted: Dict[str, Tuple[Tuple, float]] = {}
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.stats = {"polls": 0, "emitted": 0, "unchanged": 0, "errors": 0}
+
+    @abstractmethod
+    def _fetch(self) -> Iterable[Tuple[str, Tuple, Dict]]:
+        """``(key, compared values, row)`` per item seen in this poll."""
+
+    def _map(self, fn: Callable, items: List) -> List:
+        # results of the calls that worked; a failed call skips its part of the city
+        def call(item):
+            try:
+                return fn(item)
+            except TomTomAPIError as e:
+                with self._stats_lock:
+                    self.stats["errors"] += 1
+                print(f"TomTom poll failed: {str(e)}")
+                return None
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tomtom-poll") as pool:
+            return [r for r in pool.map(call, items) if r is not None]
+
+    def poll_once(self) -> int:
+        now = time.time()
+        timestamp = datetime.fromtimestamp(now, timezone.utc).strftime(self.timestamp_format)
+        emitted = 0
+        for key, values, row in self._fetch():
+            previous = self._emitted.get(key)
+            if previous is not None and previous[0] == values and now - previous[1] < self.refresh_s:
+                self.stats["unchanged"] += 1
+                continue
+            self._emitted[key] = (values, now)
+            self.next(timestamp=timestamp, **row)
+            emitted += 1
+        self.commit()
+        self.stats["polls"] += 1
+        self.stats["emitted"] += emitted
+        return emitted
+
+    def run(self):
+        polls = 0
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.poll_once()
+            polls += 1
+            if self.max_polls is not None and polls >= self.max_polls:
+                return
+            self._stop.wait(max(0.0, self.interval_s - (time.monotonic() - started)))
+
+    def on_stop(self):
+        self._stop.set()
+
+
+class TomTomFlowSubject(_PollingSubject):
+    """Flow of the road segments nearest to a grid of points over the bbox (``LiveFlowSchema`` rows)."""
+
+    def __init__(self, api: TomTomAPI, bbox: str, spacing_km: float = DEFAULT_FLOW_SPACING_KM,
+                 interval_s: float = 60.0, refresh_s: float = 120.0, workers: int = 8,
+                 timestamp_format: str = TIMESTAMP_FORMAT, max_polls: Optional[int] = None):
+        super().__init__(api, interval_s, refresh_s, workers, timestamp_format, max_polls)
+        self.points = flow_points(bbox, spacing_km)
+        # the lookup radius covers the grid cell around each point
+        self.radius_m = int(spacing_km * 1000 * 0.75)
+
+    def _point_flow(self, point: Tuple[float, float]) -> Optional[Dict]:
+        return self.api.get_traffic_flow(point[0], point[1], self.radius_m, BACKGROUND, with_geometry=True)
+
+    def _fetch(self):
+        seen = set()
+        for flow in self._map(self._point_flow, self.points):
+            coordinates = flow.get("coordinates")
+            if not coordinates:
+                continue
+            key = segment_id(coordinates)
+            # neighbouring points often land on the same segment
+            if key in seen:
+                continue
+            seen.add(key)
+            lat, lon = coordinates[len(coordinates) // 2]
+            speed, free_flow = float(flow["current_speed"]), float(flow["free_flow_speed"])
+            yield key, (speed, free_flow), {
+                "segment_id": key,
+                "speed": speed,
+                "congestion_level": congestion_level(speed, free_flow),
+                "free_flow_speed": free_flow,
+                "latitude": lat,
+                "longitude": lon,
+            }
+
+
+class TomTomIncidentSubject(_PollingSubject):
+    """Incidents in the bbox, fetched tile by tile (``TrafficEventSchema`` rows)."""
+
+    def __init__(self, api: TomTomAPI, bbox: str, tile_km: float = DEFAULT_TILE_KM,
+                 interval_s: float = 60.0, refresh_s: float = 600.0, workers: int = 4,
+                 timestamp_format: str = TIMESTAMP_FORMAT, max_polls: Optional[int] = None):
+        super().__init__(api, interval_s, refresh_s, workers, timestamp_format, max_polls)
+        self.tiles = tile_bbox(bbox, tile_km)
+
+    def _tile_incidents(self, tile: str) -> List[Dict]:
+        return self.api.get_incidents(tile, BACKGROUND)
+
+    def _fetch(self):
+        seen = set()
+        for features in self._map(self._tile_incidents, self.tiles):
+            for feature in features:
+                incident = TrafficIncident.from_tomtom(feature)
+                # an incident crossing a tile edge is returned by both tiles
+                if incident.id in seen:
+                    continue
+                seen.add(incident.id)
+                yield incident.id, (incident.type, incident.severity, incident.description), {
+                    "event_type": incident.type,
+                    "latitude": incident.location.lat,
+                    "longitude": incident.location.lon,
+                    "severity": int(incident.severity),
+                    "description": incident.description,
+                }
+
+
+def tomtom_client(api_key: str, scheduler: Optional[RequestScheduler] = None,
+                  base_url: str = TOMTOM_BASE_URL) -> TomTomAPI:
+    # background polling waits for its turn instead of failing on a busy queue
+    return TomTomAPI(api_key, scheduler=scheduler or RequestScheduler(), queue_timeout=None,
+                     base_url=base_url)
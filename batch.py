@@ -0,0 +1,265 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from main import Location, components
+from route_scorer import score_routes
+from spatial import geohash_encode
+from traffic_cache import quantize_point
+
+# trips whose endpoints share geohash-5 cells (~5km) are fetched back to back,
+# so the flow and incident indexes built for one serve the next
+TILE_PRECISION = 5
+
+
+@dataclass
+class Trip:
+    id: str
+    start: Location
+    end: Location
+    preferences: Dict = field(default_factory=dict)
+
+
+def _location(lat, lon, name: str = "") -> Location:
+    return Location(float(lat), float(lon), name)
+
+
+def load_trips(path: str) -> List[Trip]:
+    """
+    Trips from a JSONL file (``{"id", "start": {"lat", "lon"}, "end": {...},
+    "preferences": {...}}`` per line) or a CSV file with ``id, start_lat,
+    start_lon, end_lat, end_lon`` and optional ``priority, safety_priority``
+    columns. Trips without an id are numbered by line.
+    """
+    trips = []
+    if path.endswith(".csv"):
+        with open(path, newline="") as f:
+            for n, row in enumerate(csv.DictReader(f), start=1):
+                preferences = {k: row[k] for k in ("priority", "safety_priority") if row.get(k)}
+                trips.append(Trip(row.get("id") or str(n),
+                                  _location(row["start_lat"], row["start_lon"]),
+                                  _location(row["end_lat"], row["end_lon"]), preferences))
+    else:
+        with open(path) as f:
+            for n, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                start, end = data["start"], data["end"]
+                trips.append(Trip(str(data.get("id", n)),
+                                  _location(start["lat"], start["lon"], start.get("name", "")),
+                                  _location(end["lat"], end["lon"], end.get("name", "")),
+                                  data.get("preferences") or {}))
+    return trips
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """Ids already ranked successfully in ``output_path``; the output file is the checkpoint."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # an unreadable line; that trip is simply redone
+                continue
+            # failed trips, and trips written without a ranking by older runs, are redone
+            if "error" not in record and record.get("ranking"):
+                done.add(record["id"])
+    return done
+
+
+def _drop_unfinished(output_path: str, done: Set[str]):
+    """
+    Rewrite ``output_path`` with one record per trip in ``done`` (its last
+    successful one), so the trips about to be retried are not in it twice.
+    """
+    kept: Dict[str, str] = {}
+    lines = 0
+    with open(output_path) as f:
+        for line in f:
+            lines += 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("id") in done and "error" not in record and record.get("ranking"):
+                kept[record["id"]] = line
+    if lines == len(kept):
+        return
+    # write next to it and swap, so a crash here leaves the old file intact
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(kept.values())
+    os.replace(tmp_path, output_path)
+
+
+def _trim_partial_line(output_path: str):
+    # drop a last line cut short by a crash, so appended records start on a fresh line
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def plan_corridors(trips: List[Trip], precision: int = 4) -> List[List[Trip]]:
+    """
+    Group trips into corridors (same quantized start and end, so one fetch
+    serves them all) and order corridors by the tiles they start and end in.
+    """
+    corridors: Dict[Tuple, List[Trip]] = {}
+    for trip in trips:
+        key = (quantize_point(trip.start.lat, trip.start.lon, precision),
+               quantize_point(trip.end.lat, trip.end.lon, precision))
+        corridors.setdefault(key, []).append(trip)
+
+    def tile(corridor: List[Trip]) -> Tuple[str, str]:
+        start, end = corridor[0].start, corridor[0].end
+        return (geohash_encode(start.lat, start.lon, TILE_PRECISION),
+                geohash_encode(end.lat, end.lon, TILE_PRECISION))
+
+    return sorted(corridors.values(), key=tile)
+
+
+def _chunks(items: List, size: int) -> Iterator[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _score(traffic_data: Dict, preferences: Dict) -> List[Dict]:
+    # module-level so the process pool can pickle it
+    return [score.to_dict() for score in score_routes(traffic_data, preferences)]
+
+
+class _InlineExecutor(Executor):
+    """Runs submitted calls right away; used when scoring without a process pool."""
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def run_batch(input_path: str, output_path: str, fetch_workers: int = 8,
+              score_workers: Optional[int] = None, chunk_size: int = 500, resume: bool = True) -> Dict:
+    """
+    Score every trip in ``input_path`` and append one JSON line per trip to
+    ``output_path`` as results come in.
+
+    Corridors are fetched ``fetch_workers`` at a time through the shared
+    ``TrafficDataManager`` (so its caches, indexes and rate limiter apply),
+    and each trip is scored in a process pool as soon as its corridor's data
+    arrives (``score_workers=0`` scores in this process). With ``resume``,
+    trips already in ``output_path`` are skipped and the records of failed
+    trips are dropped from it before they are retried, so each trip has one
+    record.
+    """
+    trips = load_trips(input_path)
+    done = set()
+    if resume and os.path.exists(output_path):
+        _trim_partial_line(output_path)
+        done = completed_ids(output_path)
+        _drop_unfinished(output_path, done)
+    pending = [trip for trip in trips if trip.id not in done]
+    manager = components.get("traffic_manager")
+    corridors = plan_corridors(pending, manager.key_precision)
+    print(f"{len(trips)} trips, {len(done)} already done, {len(pending)} to go in {len(corridors)} corridors")
+
+    started = time.perf_counter()
+    written = failed = 0
+    scorer: Executor = (_InlineExecutor() if score_workers == 0
+                        # spawn, not fork: the fetch threads are already running
+                        else ProcessPoolExecutor(max_workers=score_workers,
+                                                 mp_context=multiprocessing.get_context("spawn")))
+    with open(output_path, "a" if resume else "w") as out, \
+            ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="batch-fetch") as fetcher, \
+            scorer:
+
+        def write(record: Dict):
+            out.write(json.dumps(record) + "\n")
+
+        for chunk in _chunks(corridors, chunk_size):
+            fetches = {fetcher.submit(manager.get_current_traffic_situation,
+                                      corridor[0].start, corridor[0].end): corridor
+                       for corridor in chunk}
+            scoring: Dict[Future, Tuple[Trip, Dict]] = {}
+            for fetch in as_completed(fetches):
+                corridor = fetches[fetch]
+                try:
+                    traffic_data = fetch.result()
+                except Exception as e:
+                    for trip in corridor:
+                        write({"id": trip.id, "error": str(e)})
+                        failed += 1
+                    continue
+                for trip in corridor:
+                    scoring[scorer.submit(_score, traffic_data, trip.preferences)] = (trip, traffic_data)
+
+            for future in as_completed(scoring):
+                trip, traffic_data = scoring[future]
+                try:
+                    ranking = future.result()
+                except Exception as e:
+                    write({"id": trip.id, "error": str(e)})
+                    failed += 1
+                    continue
+                if not ranking:
+                    # no route to rank (e.g. the routing call failed): retried on resume
+                    record = {"id": trip.id, "error": "no routes to rank"}
+                    if traffic_data.get("errors"):
+                        record["errors"] = traffic_data["errors"]
+                    write(record)
+                    failed += 1
+                    continue
+                record = {"id": trip.id, "start": trip.start.to_dict(), "end": trip.end.to_dict(),
+                          "ranking": ranking, "best_route": ranking[0]["route"]}
+                if traffic_data.get("errors"):
+                    record["errors"] = traffic_data["errors"]
+                write(record)
+                written += 1
+            # everything up to here survives a crash
+            out.flush()
+
+            elapsed = time.perf_counter() - started
+            print(f"{written + failed}/{len(pending)} trips, {(written + failed) / elapsed:.1f} trips/s")
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "trips": len(trips),
+        "skipped": len(done),
+        "written": written,
+        "failed": failed,
+        "corridors": len(corridors),
+        "elapsed_s": round(elapsed, 2),
+        "trips_per_s": round((written + failed) / elapsed, 1) if elapsed else 0.0,
+        "cache": manager.cache_stats(),
+    }
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score many origin-destination pairs")
+    parser.add_argument("input", help="trips as .jsonl or .csv")
+    parser.add_argument("output", help="results, one JSON line per trip")
+    parser.add_argument("--fetch-workers", type=int, default=8, help="corridors fetched at once")
+    parser.add_argument("--score-workers", type=int, default=None,
+                        help="scoring processes (default: CPU count, 0: score in this process)")
+    parser.add_argument("--chunk-size", type=int, default=500, help="corridors per checkpoint")
+    parser.add_argument("--restart", action="store_true", help="ignore and overwrite existing output")
+    args = parser.parse_args()
+    stats = run_batch(args.input, args.output, args.fetch_workers, args.score_workers,
+                      args.chunk_size, resume=not args.restart)
+    print(json.dumps({k: v for k, v in stats.items() if k != "cache"}, indent=2))
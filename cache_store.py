@@ -0,0 +1,115 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Hashable, Optional, Tuple
+
+
+class SQLiteCacheStore:
+    """
+    On-disk second level for TrafficCache, so cached TomTom data survives
+    restarts and is shared by worker processes on the same host.
+
+    Uses SQLite in WAL mode: readers never block each other or the writer,
+    and writers from different processes queue on ``busy_timeout``. Entries
+    keep their stale/expiry times so reads are TTL-aware, and the table is
+    compacted every ``compact_every`` writes (expired rows first, then the
+    oldest rows beyond ``max_entries``).
+    """
+
+    def __init__(self, path: str = "./cache/traffic_cache.sqlite3", max_entries: int = 50000,
+                 compact_every: int = 500, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.max_entries = max_entries
+        self.compact_every = compact_every
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS cache (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                stale_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            ) WITHOUT ROWID"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_stored_at ON cache (stored_at)")
+
+    @staticmethod
+    def _encode_key(key: Hashable) -> str:
+        return json.dumps(key, separators=(",", ":"))
+
+    def get(self, kind: str, key: Hashable, now: float) -> Optional[Tuple[Any, float, float, float]]:
+        """``(value, stored_at, stale_at, expires_at)`` if the entry exists and is not hard-expired."""
+        row = self._conn().execute(
+            "SELECT value, stored_at, stale_at, expires_at FROM cache "
+            "WHERE kind = ? AND key = ? AND expires_at > ?",
+            (kind, self._encode_key(key), now)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2], row[3]
+
+    def put(self, kind: str, key: Hashable, value: Any, stored_at: float,
+            stale_at: float, expires_at: float):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (kind, key, value, stored_at, stale_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, self._encode_key(key), json.dumps(value, separators=(",", ":")),
+             stored_at, stale_at, expires_at)
+        )
+        with self._writes_lock:
+            self._writes += 1
+            compact = self._writes % self.compact_every == 0
+        if compact:
+            self.compact(stored_at)
+
+    def compact(self, now: float):
+        """Drop expired rows, then the oldest rows above ``max_entries``."""
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM cache WHERE (kind, key) IN "
+                "(SELECT kind, key FROM cache ORDER BY stored_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def clear(self, kind: Optional[str] = None):
+        if kind is None:
+            self._conn().execute("DELETE FROM cache")
+        else:
+            self._conn().execute("DELETE FROM cache WHERE kind = ?", (kind,))
+
+    def __len__(self):
+        (count,) = self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()
+        return count
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
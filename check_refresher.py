@@ -0,0 +1,116 @@
+"""
+Smoke check of corridor refreshing, with a counting stand-in for the TomTom
+client (no API key or network needed):
+
+    python check_refresher.py
+
+Warms a corridor with a normal trip lookup, runs one ``CorridorRefresher``
+cycle and checks that it refetched flow at both ends, the incidents and the
+routes, even though the flow and incident indexes could answer them. Also
+checks that a stale entry read on the async path is refreshed by a tracked
+background task. Exits non-zero on failure.
+"""
+import asyncio
+import sys
+import threading
+import time
+
+from main import CorridorRefresher, Location, TrafficDataManager
+from traffic_cache import TrafficCache
+
+START = Location(40.7000, -74.0000, "start")
+END = Location(40.7100, -73.9900, "end")
+
+
+class CountingAPI:
+    """Answers like ``TomTomAPI`` and counts the calls per endpoint."""
+
+    def __init__(self):
+        self.calls = {"flow": 0, "incidents": 0, "routes": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self._lock:
+            self.calls[name] += 1
+
+    def get_traffic_flow(self, lat, lon, radius=1000, priority=None, with_geometry=False):
+        self._count("flow")
+        flow = {"current_speed": 25, "free_flow_speed": 50, "congestion_level": 2}
+        if with_geometry:
+            flow["coordinates"] = [(lat, lon - 0.001), (lat, lon + 0.001)]
+        return flow
+
+    def get_incidents(self, bbox, priority=None):
+        self._count("incidents")
+        return [{
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [-73.995, 40.705]},
+            "properties": {"id": "check-1", "iconCategory": 1, "magnitudeOfDelay": 2,
+                           "events": [{"description": "Accident"}]},
+        }]
+
+    def calculate_route(self, start, end, alternatives=True, priority=None):
+        self._count("routes")
+        return {"routes": [{"summary": {"travelTimeInSeconds": 600, "trafficDelayInSeconds": 60,
+                                        "lengthInMeters": 5000}, "legs": []}]}
+
+
+def check_refresh_cycle() -> bool:
+    api = CountingAPI()
+    manager = TrafficDataManager(api)
+    manager.get_current_traffic_situation(START, END)
+    warm = dict(api.calls)
+    # a second lookup is answered from the cache and the indexes
+    manager.get_current_traffic_situation(START, END)
+    ok = api.calls == warm
+
+    CorridorRefresher(manager, [(START, END)]).run_once()
+    refetched = {name: api.calls[name] - warm[name] for name in warm}
+    print(f"refresh cycle refetched {refetched}")
+    expected = {"flow": 2, "incidents": 1, "routes": 1}
+    if refetched != expected:
+        print(f"  FAILED: expected {expected}")
+        ok = False
+    manager.close()
+    return ok
+
+
+def check_async_refresh() -> bool:
+    now = [0.0]
+    cache = TrafficCache(ttls={"routes": 10}, stale_ttls={"routes": 10}, clock=lambda: now[0])
+    cache.set("routes", "corridor", "old")
+    now[0] = 15.0
+
+    async def refresh():
+        await asyncio.sleep(0.01)
+        return "new"
+
+    async def run():
+        value = await cache.aget_or_fetch("routes", "corridor", refresh)
+        tracked = len(cache._refresh_tasks)
+        # let the background refresh finish
+        for _ in range(100):
+            if not cache._refresh_tasks:
+                break
+            await asyncio.sleep(0.01)
+        return value, tracked
+
+    value, tracked = asyncio.run(run())
+    refreshed = cache.get("routes", "corridor")
+    print(f"async stale read returned {value!r}, {tracked} refresh task tracked, then {refreshed!r}")
+    if value != "old" or tracked != 1 or refreshed != "new" or cache._refresh_tasks:
+        print("  FAILED: the stale entry was not refreshed by a tracked task")
+        return False
+    return True
+
+
+def main() -> int:
+    started = time.perf_counter()
+    ok = check_refresh_cycle()
+    ok = check_async_refresh() and ok
+    print(f"{'OK' if ok else 'FAILED'} in {time.perf_counter() - started:.2f}s")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
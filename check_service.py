@@ -0,0 +1,66 @@
+"""
+Smoke check of the HTTP service's request validation, no API keys needed
+(nothing reaches a navigation run):
+
+    python check_service.py
+
+Starts the handler on a free local port and checks the answers to bad
+requests: an unusable Content-Length (non-numeric or negative) gets a 400,
+a body above the configured maximum a 413, and malformed JSON or
+coordinates a 400. Exits non-zero on failure.
+"""
+import http.client
+import json
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+from typing import Optional
+
+from service import NavigationService, make_handler
+
+MAX_BODY = 1024
+
+
+def _post(port: int, body: bytes, content_length: Optional[str] = None) -> int:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        conn.putrequest("POST", "/navigate")
+        conn.putheader("Content-Type", "application/json")
+        conn.putheader("Content-Length", str(len(body)) if content_length is None else content_length)
+        conn.endheaders()
+        conn.send(body)
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def main() -> int:
+    service = NavigationService(max_workers=1, max_body_bytes=MAX_BODY)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    valid = json.dumps({"start": {"lat": 200, "lon": 0}, "end": {"lat": 0, "lon": 0}}).encode()
+    cases = [
+        ("non-numeric Content-Length", _post(port, b"{}", "abc"), 400),
+        ("negative Content-Length", _post(port, b"{}", "-5"), 400),
+        ("body above the maximum", _post(port, b" " * (MAX_BODY + 1)), 413),
+        ("Content-Length above the maximum", _post(port, b"{}", str(MAX_BODY * 1000)), 413),
+        ("invalid JSON", _post(port, b"{nope"), 400),
+        ("coordinates out of range", _post(port, valid), 400),
+    ]
+    ok = True
+    for name, status, expected in cases:
+        print(f"{name}: {status}" + ("" if status == expected else f"  FAILED: expected {expected}"))
+        ok = ok and status == expected
+
+    server.shutdown()
+    server.server_close()
+    service.close()
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import math
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+# 5 decimals (~1m) is the precision of Google's encoded polyline format,
+# which most map clients decode out of the box
+POLYLINE_PRECISION = 5
+
+# routes are simplified to within this distance of the original geometry
+DEFAULT_TOLERANCE_M = 5.0
+
+
+def _project(points: np.ndarray) -> np.ndarray:
+    """Local equirectangular projection of ``[lat, lon]`` rows to meters; good enough at route scale."""
+    lat0 = math.radians(float(points[:, 0].mean()))
+    scale = math.pi / 180 * EARTH_RADIUS_M
+    return np.column_stack((points[:, 1] * scale * math.cos(lat0), points[:, 0] * scale))
+
+
+def simplify(points: Sequence[Sequence[float]], tolerance_m: float = DEFAULT_TOLERANCE_M) -> np.ndarray:
+    """
+    Douglas-Peucker simplification of a ``[lat, lon]`` polyline.
+
+    The recursion is unrolled onto a stack and each step measures the
+    distance of the whole span to its chord with one NumPy expression, so
+    the cost is dominated by array ops rather than Python loops. Returns
+    the kept points (always including both ends) as an ``(n, 2)`` array.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(points) < 3:
+        return points
+    xy = _project(points)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = xy[first], xy[last]
+        span = xy[first + 1:last]
+        chord = end - start
+        length_sq = float(chord @ chord)
+        if length_sq == 0:
+            distances = np.hypot(*(span - start).T)
+        else:
+            # distance to the chord segment, clamped to its ends
+            t = np.clip(((span - start) @ chord) / length_sq, 0, 1)
+            distances = np.hypot(*(span - (start + t[:, None] * chord)).T)
+        index = int(distances.argmax())
+        if distances[index] > tolerance_m:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return points[keep]
+
+
+def points_to_polyline_m(points: Sequence[Sequence[float]], polyline: Sequence[Sequence[float]]) -> np.ndarray:
+    """Distance in meters from each ``[lat, lon]`` point to a ``[lat, lon]`` polyline, all pairs at once."""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    polyline = np.asarray(polyline, dtype=float).reshape(-1, 2)
+    if not len(points) or not len(polyline):
+        return np.full(len(points), np.inf)
+    xy = _project(np.vstack((polyline, points)))
+    line, pts = xy[:len(polyline)], xy[len(polyline):]
+    if len(line) == 1:
+        return np.hypot(*(pts - line[0]).T)
+    start, chord = line[:-1], np.diff(line, axis=0)
+    length_sq = (chord ** 2).sum(axis=1)
+    # (points, segments) projection parameter, clamped to each segment
+    rel = pts[:, None, :] - start[None, :, :]
+    t = np.clip((rel * chord).sum(axis=2) / np.where(length_sq == 0, 1, length_sq), 0, 1)
+    nearest = start[None, :, :] + t[:, :, None] * chord[None, :, :]
+    return np.hypot(*(pts[:, None, :] - nearest).transpose(2, 0, 1)).min(axis=1)
+
+
+def encode_polyline(points: Sequence[Sequence[float]], precision: int = POLYLINE_PRECISION) -> str:
+    """Encode ``[lat, lon]`` points in the encoded polyline format."""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if not len(points):
+        return ""
+    scaled = np.round(points * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # zigzag: sign goes into the lowest bit
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    chars = []
+    for value in values.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def decode_polyline(encoded: str, precision: int = POLYLINE_PRECISION) -> List[Tuple[float, float]]:
+    """Inverse of ``encode_polyline``: a list of ``(lat, lon)`` tuples."""
+    values = []
+    value = shift = 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    if not values:
+        return []
+    coords = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return [tuple(row) for row in coords.tolist()]
+
+
+def compact_route_geometry(routes: Dict, tolerance_m: float = DEFAULT_TOLERANCE_M) -> Dict:
+    """
+    Replace the raw ``points`` of every leg in a TomTom routing response with
+    a simplified, encoded ``encodedPolyline`` (plus ``pointCount``). Edits
+    and returns ``routes``; responses without geometry pass through untouched.
+    """
+    for route in routes.get("routes", []) if isinstance(routes, dict) else []:
+        for leg in route.get("legs", []):
+            raw = leg.pop("points", None)
+            if not raw:
+                continue
+            simplified = simplify([[p["latitude"], p["longitude"]] for p in raw], tolerance_m)
+            leg["encodedPolyline"] = encode_polyline(simplified)
+            leg["pointCount"] = len(simplified)
+    return routes
@@ -0,0 +1,93 @@
+import hashlib
+import re
+import time
+from typing import Any, Callable, Dict, Optional
+
+from langchain.globals import set_llm_cache
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+
+from cache_store import SQLiteCacheStore
+from traffic_cache import TrafficCache
+
+# an answered navigation prompt stays reusable this long (seconds)
+DEFAULT_LLM_TTL = 300
+
+_ISO_TIMESTAMP = re.compile(r"(\d{4}-\d{2}-\d{2})T(\d{2}):(\d{2}):\d{2}(?:\.\d+)?")
+_DECIMAL = re.compile(r"-?\d+\.\d+")
+_SPACES = re.compile(r" {2,}")
+
+
+class LLMResponseCache(BaseCache):
+    """
+    LangChain cache for the crew's LLM calls (install with ``enable_llm_cache``).
+
+    Entries are keyed by a hash of the model settings (``llm_string``: model,
+    temperature, max tokens, ...) and the normalized prompt, which already
+    carries the agent's role and the compact task input. Normalizing collapses
+    indentation, rounds ISO timestamps down to ``time_bucket_s`` and, with
+    ``number_precision`` set, rounds decimals, so near-identical traffic
+    snapshots share an answer.
+
+    Storage is a ``TrafficCache`` (TTL + LRU) with an optional
+    ``SQLiteCacheStore`` behind it, so answers can be shared across
+    processes and restarts.
+    """
+
+    KIND = "llm"
+
+    def __init__(self, ttl: float = DEFAULT_LLM_TTL, max_entries: int = 1024,
+                 store: Optional[SQLiteCacheStore] = None, number_precision: Optional[int] = None,
+                 time_bucket_s: int = 300, clock: Callable[[], float] = time.time):
+        self.number_precision = number_precision
+        self.time_bucket_s = time_bucket_s
+        self.cache = TrafficCache(max_entries=max_entries, ttls={self.KIND: ttl},
+                                  clock=clock, store=store)
+
+    def normalize(self, prompt: str) -> str:
+        prompt = _ISO_TIMESTAMP.sub(self._bucket_timestamp, prompt)
+        if self.number_precision is not None:
+            prompt = _DECIMAL.sub(lambda m: f"{float(m.group()):.{self.number_precision}f}", prompt)
+        return _SPACES.sub(" ", prompt)
+
+    def _bucket_timestamp(self, match: "re.Match") -> str:
+        day, hour, minute = match.group(1), int(match.group(2)), int(match.group(3))
+        minutes = hour * 60 + minute
+        minutes -= minutes % max(1, self.time_bucket_s // 60)
+        return f"{day}T{minutes // 60:02d}:{minutes % 60:02d}"
+
+    def _key(self, prompt: str, llm_string: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(llm_string.encode())
+        digest.update(b"\0")
+        digest.update(self.normalize(prompt).encode())
+        return digest.hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        value = self.cache.get(self.KIND, self._key(prompt, llm_string))
+        if value is None:
+            return None
+        try:
+            return [loads(generation) for generation in value]
+        except Exception as e:
+            print(f"Could not load cached LLM response: {str(e)}")
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        # generations are kept serialized so the memory and disk layers hold
+        # the same JSON and every hit gets its own copy
+        self.cache.set(self.KIND, self._key(prompt, llm_string),
+                       [dumps(generation) for generation in return_val])
+
+    def clear(self, **kwargs: Any) -> None:
+        self.cache.invalidate(self.KIND)
+
+    def snapshot(self) -> Dict:
+        return self.cache.snapshot()
+
+
+def enable_llm_cache(path: Optional[str] = None, **kwargs) -> LLMResponseCache:
+    """Install an ``LLMResponseCache`` for every LangChain model in the process."""
+    cache = LLMResponseCache(store=SQLiteCacheStore(path) if path else None, **kwargs)
+    set_llm_cache(cache)
+    return cache
@@ -1,55 +1,104 @@
+import time
+_import_started = time.perf_counter()
+
 from math import exp
 import os
-from crewai import Agent, Task, Crew, Process
-from langchain_groq import ChatGroq
-from langchain.tools import DuckDuckGoSearchRun
-from langchain.tools import StructuredTool
+# crewai, langchain, langchain_groq and aiohttp are slow to import; they are
+# imported where first used (see the component factories below)
 from pydantic import BaseModel
+import asyncio
+import inspect
 import requests
-from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+import random
+import sys
+import threading
+from datetime import datetime
 import json
 from dataclasses import dataclass
-from typing import List, Dict, Optional,Callable
+from typing import TYPE_CHECKING, Any, List, Dict, Optional,Callable, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import requests
-from langchain.tools import StructuredTool
 from pydantic import BaseModel
 import os
 from dotenv import load_dotenv
+from registry import Registry
+from traffic_cache import TrafficCache, SingleFlight, ToolMemo, quantize_point, DEFAULT_TTLS, DEFAULT_STALE_TTLS
+from cache_store import SQLiteCacheStore
+from spatial import FlowTileIndex, IncidentIndex
+from scheduler import RequestScheduler, SchedulerError, INTERACTIVE, BACKGROUND
+from prompt_payload import PromptPayload, truncate_to_budget
+from geometry import compact_route_geometry, DEFAULT_TOLERANCE_M
+from route_scorer import score_routes, format_route_ranking
+
+if TYPE_CHECKING:
+    import aiohttp
 
 class SearchInput(BaseModel):
     query: str 
-search_tool = StructuredTool(
-    name="Internet Search",
-    func=DuckDuckGoSearchRun().run,  
-    description="Search the internet for up-to-date information on traffic condition , real time incidents realted to the place in context asked by user",
-    args_schema=SearchInput  
-)
 class Tool(BaseModel):
     name: str
     function: Callable
     description: str
+    # with both set, calls are answered from the shared tool memo (a ToolMemo)
+    ttl: Optional[float] = None
+    memo: Optional[Any] = None
 
     def run(self, *args, **kwargs):
-        return self.function(*args, **kwargs)
+        try:
+            if self.memo is not None and self.ttl:
+                return self.memo.call(self.name, self.ttl, self.function, args, kwargs)
+            return self.function(*args, **kwargs)
+        except TomTomAPIError as e:
+            # hand the agent a readable error instead of failing its whole turn
+            return e.to_dict()
 
 #env loadings...
 
 load_dotenv()
 
 
-TOMTOM_API_KEY = os.environ["TOMTOM_API_KEY"]
-groq_api_key = os.environ["GROQ_API_KEY"]
+def _env(name: str) -> str:
+    # read on first use, so importing this module works without the keys
+    try:
+        return os.environ[name]
+    except KeyError:
+        raise RuntimeError(f"{name} is not set; add it to the environment or .env") from None
+
+# shared clients, LLM, tools and agents are built on first use and then
+# reused: components.get("llm") inside this module, main.llm from outside
+components = Registry()
+
+def _token_stream():
+    from streaming import TokenStreamHandler
+    return TokenStreamHandler()
+
+def _llm_cache():
+    from llm_cache import enable_llm_cache
+    # repeated prompts (same model settings, agent and task input) are answered
+    # from cache; LLM_CACHE_PATH shares the answers between processes
+    return enable_llm_cache(os.environ.get("LLM_CACHE_PATH"))
 
 #we'll use groqq
 #todo - try with openai also to see which gives better results
 
-llm = ChatGroq(
-    api_key=groq_api_key,
-    model_name="groq/llama3-8b-8192",
-    temperature=0.7,
-    max_tokens=1024
-)
+def _llm():
+    from langchain_groq import ChatGroq
+    components.get("llm_cache")
+    return ChatGroq(
+        api_key=_env("GROQ_API_KEY"),
+        model_name="groq/llama3-8b-8192",
+        temperature=0.7,
+        max_tokens=1024,
+        # tokens go to whichever stream is listening in the calling thread (see streaming.py)
+        streaming=True,
+        callbacks=[components.get("token_stream")]
+    )
+
+components.register("token_stream", _token_stream)
+components.register("llm_cache", _llm_cache)
+components.register("llm", _llm)
 
 # 
 # class SearchInput(BaseModel):
@@ -75,6 +124,13 @@ class Location:
             "name": self.name
         }
 
+# TomTom incidentDetails iconCategory codes
+INCIDENT_CATEGORIES = {
+    0: "Unknown", 1: "Accident", 2: "Fog", 3: "DangerousConditions", 4: "Rain",
+    5: "Ice", 6: "Jam", 7: "LaneClosed", 8: "RoadClosed", 9: "RoadWorks",
+    10: "Wind", 11: "Flooding", 14: "BrokenDownVehicle"
+}
+
 @dataclass
 class TrafficIncident:
     type: str
@@ -82,9 +138,11 @@ class TrafficIncident:
     description: str
     severity: int
     delay: int
+    id: Optional[str] = None
     
     def to_dict(self):
         return {
+            "id": self.id,
             "type": self.type,
             "location": self.location.to_dict(),
             "description": self.description,
@@ -92,56 +150,124 @@ class TrafficIncident:
             "delay": self.delay
         }
 
-class TomTomAPI:
-    def __init__(self, api_key):
+    @classmethod
+    def from_tomtom(cls, feature: Dict) -> "TrafficIncident":
+        """Build a compact record from an incidentDetails (v5) GeoJSON feature."""
+        props = feature.get('properties', {})
+        geometry = feature.get('geometry', {})
+        coords = geometry.get('coordinates') or [0.0, 0.0]
+        # Point is [lon, lat], LineString is [[lon, lat], ...]; use the first point
+        lon, lat = coords[0] if geometry.get('type') == 'LineString' else coords
+        description = "; ".join(
+            e['description'] for e in props.get('events') or [] if e.get('description')
+        )
+        incident_id = props.get('id') or f"{lat:.5f},{lon:.5f}:{description}"
+        return cls(
+            type=INCIDENT_CATEGORIES.get(props.get('iconCategory'), "Unknown"),
+            location=Location(lat, lon, props.get('from') or ""),
+            description=description,
+            severity=props.get('magnitudeOfDelay') or 0,
+            delay=props.get('delay') or 0,
+            id=incident_id
+        )
+
+class TomTomAPIError(Exception):
+    """Raised when a TomTom request fails for good (non-retryable status or retries exhausted)."""
+
+    def __init__(self, endpoint: str, message: str, status: Optional[int] = None, attempts: int = 1):
+        super().__init__(f"{message} (endpoint={endpoint}, status={status}, attempts={attempts})")
+        self.endpoint = endpoint
+        self.message = message
+        self.status = status
+        self.attempts = attempts
+
+    def to_dict(self):
+        return {
+            "error": self.message,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "attempts": self.attempts
+        }
+
+@dataclass
+class RetryPolicy:
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504)
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        # honour Retry-After when TomTom sends one, otherwise full-jitter exponential backoff
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+TOMTOM_BASE_URL = "https://api.tomtom.com"
+
+class _TomTomClientBase:
+    """
+    Request building, response parsing and retry decisions shared by the
+    sync and async TomTom clients, so the two cannot drift apart. Subclasses
+    only implement the transport (``_make_request``).
+    """
+
+    def __init__(self, api_key, retry_policy: Optional[RetryPolicy] = None,
+                 scheduler: Optional[RequestScheduler] = None, queue_timeout: Optional[float] = 5.0,
+                 route_tolerance_m: Optional[float] = DEFAULT_TOLERANCE_M,
+                 base_url: str = TOMTOM_BASE_URL):
         self.api_key = api_key
-        self.base_url = "https://api.tomtom.com"
+        # point at a local mock server to run without TomTom
+        self.base_url = base_url.rstrip("/")
+        self.retry_policy = retry_policy or RetryPolicy()
+        # optional client-side rate limiting; share one scheduler between clients
+        # that draw from the same API key
+        self.scheduler = scheduler
+        self.queue_timeout = queue_timeout
+        # route legs are simplified to within this many meters and polyline
+        # encoded; None keeps TomTom's raw point arrays
+        self.route_tolerance_m = route_tolerance_m
 
-    def get_traffic_flow(self, lat: float, lon: float, radius: int = 1000) -> Optional[Dict]:
-        """
-        Fetches real-time traffic data from TomTom Traffic Flow API.
-        
-        :param lat: Latitude of the center point
-        :param lon: Longitude of the center point
-        :param radius: Radius (in meters) to search around the center point
-        :return: Dictionary containing traffic speed and congestion level, or None if the request fails
-        """
+    def _flow_request(self, lat: float, lon: float, radius: int) -> Tuple[str, Dict]:
         endpoint = f"{self.base_url}/traffic/services/4/flowSegmentData/absolute/10/json"
         params = {
             'key': self.api_key,
             'point': f"{lat},{lon}",
             'radius': radius
         }
+        return endpoint, params
+
+    def _parse_flow(self, data: Dict, with_geometry: bool = False) -> Optional[Dict]:
+        flow_segment = data.get('flowSegmentData', {})
         
-        try:
-            response = requests.get(endpoint, params=params)
-            response.raise_for_status()
-            data = response.json()
-            flow_segment = data.get('flowSegmentData', {})
-            
-            if flow_segment:
-                return {
-                    "current_speed": flow_segment['currentSpeed'],
-                    "free_flow_speed": flow_segment['freeFlowSpeed'],
-                    "congestion_level": flow_segment['confidence']  
-                }
-            return None
-        except requests.RequestException as e:
-            print(f"Error fetching traffic flow data: {str(e)}")
-            return None
+        if flow_segment:
+            flow = {
+                "current_speed": flow_segment['currentSpeed'],
+                "free_flow_speed": flow_segment['freeFlowSpeed'],
+                "congestion_level": flow_segment['confidence']  
+            }
+            if with_geometry:
+                # segment shape as [lat, lon] pairs, used to index the segment spatially
+                flow["coordinates"] = [
+                    [c['latitude'], c['longitude']]
+                    for c in flow_segment.get('coordinates', {}).get('coordinate', [])
+                ]
+            return flow
+        return None
 
-    def get_incidents(self, bbox: str) -> List[Dict]:
+    def _incidents_request(self, bbox: str) -> Tuple[str, Dict]:
         endpoint = f"{self.base_url}/traffic/services/5/incidentDetails"
         params = {
             "key": self.api_key,
             "bbox": bbox,
-            "fields": "{incidents{type,geometry,description,severity,delay}}"
+            "fields": "{incidents{type,geometry{type,coordinates},"
+                      "properties{id,iconCategory,magnitudeOfDelay,events{description},from,delay}}}"
         }
-        response = self._make_request(endpoint, params)
-        return response.get('incidents', [])
+        return endpoint, params
 
-    def calculate_route(self, start: Location, end: Location, 
-                        alternatives: bool = True) -> Dict:
+    def _parse_incidents(self, data: Dict) -> List[Dict]:
+        return data.get('incidents', [])
+
+    def _route_request(self, start: Location, end: Location, alternatives: bool) -> Tuple[str, Dict]:
         endpoint = f"{self.base_url}/routing/1/calculateRoute/{start.lat},{start.lon}:{end.lat},{end.lon}/json"
         params = {
             "key": self.api_key,
@@ -150,16 +276,223 @@ class TomTomAPI:
             "maxAlternatives": 3,
             "reportGeometry": "true"
         }
-        return self._make_request(endpoint, params)
+        return endpoint, params
 
-    def _make_request(self, endpoint: str, params: Dict) -> Dict:
-        try:
-            response = requests.get(endpoint, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Error making request to {endpoint}: {str(e)}")
-            return {}
+    def _parse_route(self, data: Dict) -> Dict:
+        if self.route_tolerance_m is None:
+            return data
+        return compact_route_geometry(data, self.route_tolerance_m)
+
+    def _status_error(self, endpoint: str, status: int, reason: Optional[str],
+                      attempt: int) -> Tuple[TomTomAPIError, bool]:
+        """Error for an HTTP failure status, and whether it is worth retrying."""
+        error = TomTomAPIError(endpoint, reason or "request failed", status, attempt + 1)
+        return error, status in self.retry_policy.retry_statuses
+
+    def _transport_error(self, endpoint: str, exc: Exception, attempt: int) -> TomTomAPIError:
+        # connection errors and timeouts are always worth another try;
+        # the message can contain the full URL, so keep the key out of it
+        return TomTomAPIError(endpoint, self._redact(f"{type(exc).__name__}: {exc}"),
+                              attempts=attempt + 1)
+
+    def _scheduler_error(self, endpoint: str, exc: SchedulerError, attempt: int) -> TomTomAPIError:
+        return TomTomAPIError(endpoint, str(exc), attempts=attempt + 1)
+
+    def _backoff(self, family: str, status: Optional[int], attempt: int,
+                 retry_after: Optional[float]) -> float:
+        delay = self.retry_policy.delay(attempt, retry_after)
+        # a 429 means the whole family is over quota, not just this request
+        if status == 429 and self.scheduler is not None:
+            self.scheduler.penalize(family, delay)
+        return delay
+
+    def _redact(self, message: str) -> str:
+        return message.replace(self.api_key, "***") if self.api_key else message
+
+class TomTomAPI(_TomTomClientBase):
+    def __init__(self, api_key, pool_size: int = 20, connect_timeout: float = 3.05,
+                 read_timeout: float = 10.0, retry_policy: Optional[RetryPolicy] = None,
+                 scheduler: Optional[RequestScheduler] = None, queue_timeout: Optional[float] = 5.0,
+                 route_tolerance_m: Optional[float] = DEFAULT_TOLERANCE_M,
+                 base_url: str = TOMTOM_BASE_URL):
+        super().__init__(api_key, retry_policy, scheduler, queue_timeout, route_tolerance_m, base_url)
+        self.timeout = (connect_timeout, read_timeout)
+        # one keep-alive session so DNS/TCP/TLS setup is paid once per connection, not per call
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_traffic_flow(self, lat: float, lon: float, radius: int = 1000,
+                         priority: int = INTERACTIVE, with_geometry: bool = False) -> Optional[Dict]:
+        """
+        Fetches real-time traffic data from TomTom Traffic Flow API.
+        
+        :param lat: Latitude of the center point
+        :param lon: Longitude of the center point
+        :param radius: Radius (in meters) to search around the center point
+        :param priority: scheduler lane, INTERACTIVE or BACKGROUND
+        :param with_geometry: also return the segment's ``coordinates``
+        :return: Dictionary containing traffic speed and congestion level, or None if TomTom has no segment there
+        :raises TomTomAPIError: if the request fails
+        """
+        return self._parse_flow(
+            self._make_request(*self._flow_request(lat, lon, radius), "flow", priority), with_geometry)
+
+    def get_incidents(self, bbox: str, priority: int = INTERACTIVE) -> List[Dict]:
+        return self._parse_incidents(self._make_request(*self._incidents_request(bbox), "incidents", priority))
+
+    def calculate_route(self, start: Location, end: Location, 
+                        alternatives: bool = True, priority: int = INTERACTIVE) -> Dict:
+        return self._parse_route(
+            self._make_request(*self._route_request(start, end, alternatives), "routing", priority))
+
+    def _make_request(self, endpoint: str, params: Dict, family: str,
+                      priority: int = INTERACTIVE) -> Dict:
+        attempt = 0
+        while True:
+            retry_after = None
+            status = None
+            if self.scheduler is not None:
+                try:
+                    self.scheduler.acquire(family, priority, self.queue_timeout)
+                except SchedulerError as e:
+                    raise self._scheduler_error(endpoint, e, attempt)
+            try:
+                response = self.session.get(endpoint, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = self._transport_error(endpoint, e, attempt)
+            else:
+                if response.status_code < 400:
+                    try:
+                        return response.json()
+                    except ValueError:
+                        raise TomTomAPIError(endpoint, "invalid JSON in response",
+                                             response.status_code, attempt + 1)
+                status = response.status_code
+                error, retryable = self._status_error(endpoint, status, response.reason, attempt)
+                if not retryable:
+                    raise error
+                retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+
+            if attempt >= self.retry_policy.max_retries:
+                raise error
+            time.sleep(self._backoff(family, status, attempt, retry_after))
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
+class AsyncTomTomAPI(_TomTomClientBase):
+    """
+    asyncio counterpart of TomTomAPI built on aiohttp.
+
+    ``max_concurrency`` caps the number of requests in flight at once across
+    all callers sharing this client, which keeps bursts inside the API quota.
+    The aiohttp session is created lazily inside the running event loop, and
+    replaced when the client is used from another loop (e.g. a second
+    ``asyncio.run``), since a session only works on the loop it was made on.
+    """
+
+    def __init__(self, api_key, pool_size: int = 100, max_concurrency: int = 20,
+                 connect_timeout: float = 3.05, read_timeout: float = 10.0,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 scheduler: Optional[RequestScheduler] = None, queue_timeout: Optional[float] = 5.0,
+                 route_tolerance_m: Optional[float] = DEFAULT_TOLERANCE_M,
+                 base_url: str = TOMTOM_BASE_URL):
+        super().__init__(api_key, retry_policy, scheduler, queue_timeout, route_tolerance_m, base_url)
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _get_session(self) -> "aiohttp.ClientSession":
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        if self._session is not None and self._loop is not loop:
+            # made on an earlier loop (likely closed by now): close it and start over
+            old, self._session = self._session, None
+            try:
+                await old.close()
+            except Exception as e:
+                print(f"Closing the previous aiohttp session failed: {str(e)}")
+        if self._session is None or self._session.closed:
+            self._loop = loop
+            self.timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def get_traffic_flow(self, lat: float, lon: float, radius: int = 1000,
+                               priority: int = INTERACTIVE, with_geometry: bool = False) -> Optional[Dict]:
+        return self._parse_flow(
+            await self._make_request(*self._flow_request(lat, lon, radius), "flow", priority), with_geometry)
+
+    async def get_incidents(self, bbox: str, priority: int = INTERACTIVE) -> List[Dict]:
+        return self._parse_incidents(
+            await self._make_request(*self._incidents_request(bbox), "incidents", priority))
+
+    async def calculate_route(self, start: Location, end: Location,
+                              alternatives: bool = True, priority: int = INTERACTIVE) -> Dict:
+        return self._parse_route(
+            await self._make_request(*self._route_request(start, end, alternatives), "routing", priority))
+
+    async def _make_request(self, endpoint: str, params: Dict, family: str,
+                            priority: int = INTERACTIVE) -> Dict:
+        import aiohttp
+        session = await self._get_session()
+        # aiohttp only accepts str/int query values
+        params = {k: str(v) for k, v in params.items()}
+        attempt = 0
+        while True:
+            retry_after = None
+            status = None
+            if self.scheduler is not None:
+                try:
+                    await self.scheduler.acquire_async(family, priority, self.queue_timeout)
+                except SchedulerError as e:
+                    raise self._scheduler_error(endpoint, e, attempt)
+            try:
+                async with self._semaphore:
+                    async with session.get(endpoint, params=params) as response:
+                        if response.status < 400:
+                            try:
+                                return await response.json(content_type=None)
+                            except ValueError:
+                                raise TomTomAPIError(endpoint, "invalid JSON in response",
+                                                     response.status, attempt + 1)
+                        status = response.status
+                        error, retryable = self._status_error(endpoint, status, response.reason, attempt)
+                        if not retryable:
+                            raise error
+                        retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = self._transport_error(endpoint, e, attempt)
+
+            if attempt >= self.retry_policy.max_retries:
+                raise error
+            await asyncio.sleep(self._backoff(family, status, attempt, retry_after))
+            attempt += 1
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
 
 def get_bbox(start: Location, end: Location) -> str:
     
@@ -172,175 +505,696 @@ def get_bbox(start: Location, end: Location) -> str:
 
 
 class TrafficDataManager:
-    def __init__(self, tomtom_api: TomTomAPI):
+    # value used for a piece of traffic data that failed or timed out,
+    # matching what TomTomAPI returned for a failed request
+    EMPTY_RESULTS = {
+        'start_traffic': None,
+        'end_traffic': None,
+        'incidents': [],
+        'routes': {},
+    }
+
+    def __init__(self, tomtom_api: TomTomAPI, cache: Optional[TrafficCache] = None,
+                 key_precision: int = 4, max_workers: int = 8, call_timeout: float = 10.0,
+                 async_api: Optional[AsyncTomTomAPI] = None, flow_index: Optional[FlowTileIndex] = None):
         self.api = tomtom_api
-        self.cached_data = {}
-        self.cache_timestamp = None
-        self.cache_duration = timedelta(minutes=5)
+        self.async_api = async_api
+        # shared across trips; keyed by quantized coordinates per data kind
+        self.cache = cache if cache is not None else TrafficCache()
+        self.key_precision = key_precision
+        # the four TomTom calls per trip are independent, so they run side by side
+        self.call_timeout = call_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tomtom")
+        self._trips = SingleFlight()
+        # flow segments by geohash cell, so nearby points on the same road share one flow call
+        self.flow_index = flow_index if flow_index is not None else FlowTileIndex(ttl=self.cache.ttls["flow"])
+        # incidents by grid cell with fetched-area coverage, so overlapping trips reuse downloads
+        self.incident_index = IncidentIndex(ttl=self.cache.ttls["incidents"],
+                                            stale_ttl=self.cache.stale_ttls.get("incidents", 0))
+
+    def _point_key(self, loc: Location):
+        return quantize_point(loc.lat, loc.lon, self.key_precision)
+
+    def _trip_fetches(self, start: Location, end: Location, api, get_or_fetch,
+                      refreshing: bool = False) -> Dict[str, Callable]:
+        """
+        The four lookups that make up a trip, each going through the cache.
+        ``api``/``get_or_fetch`` are either the sync client and
+        ``cache.get_or_fetch`` or the async client and ``cache.aget_or_fetch``.
+        With ``refreshing`` (and ``cache.refresh``) every piece is refetched,
+        whatever the indexes hold.
+        """
+        start_key = self._point_key(start)
+        end_key = self._point_key(end)
+
+        def lookup(kind, key, call, **options):
+            # cache misses are fetched at interactive priority, stale entries
+            # are refreshed in the background lane
+            return lambda: get_or_fetch(kind, key, lambda: call(INTERACTIVE),
+                                        refresh=lambda: call(BACKGROUND), **options)
+
+        def flow_call(loc, priority):
+            fetched_at = self.flow_index.clock()
+            return self._index_flow(
+                api.get_traffic_flow(loc.lat, loc.lon, priority=priority, with_geometry=True), fetched_at)
+
+        def flow_lookup(loc, key):
+            cached = lookup("flow", key, lambda p: flow_call(loc, p))
+            if refreshing:
+                # keeping the point warm: refetch into the cache and the index
+                return cached
+
+            def run():
+                # a fresh segment passing near this point answers for it
+                flow = self.flow_index.nearest(loc.lat, loc.lon)
+                return flow if flow is not None else cached()
+            return run
+
+        return {
+            #getting traffic flow
+            'start_traffic': flow_lookup(start, start_key),
+            'end_traffic': flow_lookup(end, end_key),
+            'incidents': lambda: self._incidents_lookup(start, end, api, lookup, refreshing),
+            'routes': lookup(
+                "routes", (start_key, end_key), lambda p: api.calculate_route(start, end, priority=p)),
+        }
+
+    def _incidents_lookup(self, start: Location, end: Location, api, lookup, refreshing: bool = False):
+        """
+        Incidents for the trip's bbox. Only the part of the bbox the incident
+        index has no fresh coverage for is fetched (snapped to index cells,
+        which also makes it a stable cache key); the rest is answered locally.
+        Coverage that is stale but still servable is answered locally too,
+        while one background refresh refetches the expired part.
+        """
+        area = (min(start.lon, end.lon), min(start.lat, end.lat),
+                max(start.lon, end.lon), max(start.lat, end.lat))
+        if refreshing:
+            missing = self.incident_index.snap(area)
+        else:
+            missing = self.incident_index.uncovered(area)
+            if missing is None:
+                return [incident.to_dict() for incident in self.incident_index.query(area)]
+            if self.incident_index.servable(area):
+                self.cache.revalidate("incidents", missing, lambda: self._refetch_incidents(missing))
+                return [incident.to_dict() for incident in self.incident_index.query(area)]
+        missing_bbox = ",".join(str(v) for v in missing)
+        fetch = lookup("incidents", missing, lambda p: api.get_incidents(missing_bbox, priority=p),
+                       with_stored_at=True)
+        return self._index_incidents(fetch(), missing, area)
+
+    def _refetch_incidents(self, fetched_area):
+        # runs on the cache's refresh threads, so the sync client even for async trips
+        features = self.api.get_incidents(",".join(str(v) for v in fetched_area), priority=BACKGROUND)
+        self.incident_index.add(fetched_area, [TrafficIncident.from_tomtom(f) for f in features])
+        return features
+
+    def _index_incidents(self, result, fetched_area, area):
+        if inspect.isawaitable(result):
+            async def index_when_done():
+                return self._index_incidents(await result, fetched_area, area)
+            return index_when_done()
+
+        # coverage dates from the fetch, not from now: a response read back from
+        # the cache or its store must not count as fresh for another full TTL
+        features, stored_at = result
+        self.incident_index.add(fetched_area, [TrafficIncident.from_tomtom(f) for f in features], stored_at)
+        return [incident.to_dict() for incident in self.incident_index.query(area)]
+
+    def _index_flow(self, result, fetched_at: float):
+        """
+        Move the segment geometry of a flow result fetched at ``fetched_at``
+        into ``flow_index``; works on sync or async results.
+        """
+        if inspect.isawaitable(result):
+            async def index_when_done():
+                return self._index_flow(await result, fetched_at)
+            return index_when_done()
+
+        if result and 'coordinates' in result:
+            self.flow_index.add(result.pop('coordinates'), result, fetched_at)
+        return result
 
     def get_current_traffic_situation(self, start: Location, end: Location) -> Dict:
+        # identical trips asked at the same moment share one fan-out; each
+        # piece is also coalesced per key inside the cache
+        trip_key = (self._point_key(start), self._point_key(end))
+        return dict(self._trips.do(trip_key, lambda: self._fetch_trip(start, end)))
+
+    def _fetch_trip(self, start: Location, end: Location) -> Dict:
         current_time = datetime.now()
-        if (self.cache_timestamp is None or
-            current_time - self.cache_timestamp > self.cache_duration):
-            
-            #getting traffic flow
-            start_traffic = self.api.get_traffic_flow(start.lat, start.lon)
-            end_traffic = self.api.get_traffic_flow(end.lat, end.lon)
-            
-            #bounding box calci
-            bbox = get_bbox(start, end)
-            
-            self.cached_data = {
-                'start_traffic': start_traffic,
-                'end_traffic': end_traffic,
-                'incidents': self.api.get_incidents(bbox),
-                'routes': self.api.calculate_route(start, end),
-                'timestamp': current_time.isoformat()
-            }
-            self.cache_timestamp = current_time
-        
-        return self.cached_data
+        fetches = self._trip_fetches(start, end, self.api, self.cache.get_or_fetch)
+        traffic_data, errors = self._fan_out(fetches)
+        traffic_data['timestamp'] = current_time.isoformat()
+        if errors:
+            traffic_data['errors'] = errors
+        return traffic_data
+
+    async def get_current_traffic_situation_async(self, start: Location, end: Location) -> Dict:
+        if self.async_api is None:
+            raise RuntimeError("TrafficDataManager was created without an async_api")
+        trip_key = (self._point_key(start), self._point_key(end))
+        return dict(await self._trips.do_async(trip_key, lambda: self._fetch_trip_async(start, end)))
+
+    async def _fetch_trip_async(self, start: Location, end: Location) -> Dict:
+        current_time = datetime.now()
+        fetches = self._trip_fetches(start, end, self.async_api, self.cache.aget_or_fetch)
+        traffic_data, errors = await self._afan_out(fetches)
+        traffic_data['timestamp'] = current_time.isoformat()
+        if errors:
+            traffic_data['errors'] = errors
+        return traffic_data
+
+    def _fan_out(self, fetches: Dict[str, Callable]) -> Tuple[Dict, Dict]:
+        """
+        Run the fetches concurrently and wait at most ``call_timeout`` for each,
+        counted from when a worker starts it: time spent queued behind other
+        trips' fetches (e.g. a batch with many fetch workers) does not count.
+
+        Returns ``(results, errors)``. A fetch that raised or did not finish in
+        time gets its EMPTY_RESULTS value and an entry in ``errors``; the rest
+        are returned as usual. Calls that time out keep running in the pool
+        and still fill the cache for the next lookup.
+        """
+        changed = threading.Condition()
+        started: Dict[str, float] = {}
+
+        def timed(name, fetch):
+            def run():
+                with changed:
+                    started[name] = time.monotonic()
+                    changed.notify_all()
+                return fetch()
+            return run
+
+        def notify(_):
+            with changed:
+                changed.notify_all()
+
+        futures = {name: self._executor.submit(timed(name, fetch)) for name, fetch in fetches.items()}
+        for future in futures.values():
+            future.add_done_callback(notify)
+
+        with changed:
+            while True:
+                now = time.monotonic()
+                deadlines = [started[name] + self.call_timeout for name, future in futures.items()
+                             if not future.done() and name in started]
+                running = [d for d in deadlines if d > now]
+                queued = any(not future.done() and name not in started for name, future in futures.items())
+                if not running and not queued:
+                    break
+                # woken when a fetch starts or finishes
+                changed.wait(min(running) - now if running else None)
+
+        results, errors = {}, {}
+        for name, future in futures.items():
+            if not future.done():
+                errors[name] = f"timed out after {self.call_timeout}s"
+            elif future.exception() is not None:
+                error = future.exception()
+                errors[name] = error.to_dict() if isinstance(error, TomTomAPIError) else str(error)
+            else:
+                results[name] = future.result()
+                continue
+            results[name] = self.EMPTY_RESULTS.get(name)
+        return results, errors
+
+    def refresh_trip(self, start: Location, end: Location) -> Dict:
+        """Refetch every piece of a trip at background priority and store it, ignoring the cache."""
+        # cache.refresh runs the background-lane callable _trip_fetches hands it
+        fetches = self._trip_fetches(start, end, self.api, self.cache.refresh, refreshing=True)
+        traffic_data, errors = self._fan_out(fetches)
+        if errors:
+            traffic_data['errors'] = errors
+        return traffic_data
+
+    async def _afan_out(self, fetches: Dict[str, Callable]) -> Tuple[Dict, Dict]:
+        """asyncio version of ``_fan_out`` with the same timeout and partial-result rules."""
+        # shield so a timed out call is not cancelled and still fills the cache
+        tasks = {name: asyncio.ensure_future(_resolve(fetch())) for name, fetch in fetches.items()}
+        outcomes = await asyncio.gather(
+            *(asyncio.wait_for(asyncio.shield(task), self.call_timeout) for task in tasks.values()),
+            return_exceptions=True
+        )
+
+        results, errors = {}, {}
+        for name, outcome in zip(tasks, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                errors[name] = f"timed out after {self.call_timeout}s"
+            elif isinstance(outcome, Exception):
+                errors[name] = outcome.to_dict() if isinstance(outcome, TomTomAPIError) else str(outcome)
+            else:
+                results[name] = outcome
+                continue
+            results[name] = self.EMPTY_RESULTS.get(name)
+        return results, errors
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    # single lookups for the agent tools; they share the cache and indexes with the trip fetches
+
+    def get_traffic_flow(self, lat: float, lon: float) -> Optional[Dict]:
+        loc = Location(lat, lon, "")
+        return self._trip_fetches(loc, loc, self.api, self.cache.get_or_fetch)['start_traffic']()
+
+    def get_incidents(self, bbox: str) -> List[Dict]:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+        corner, opposite = Location(min_lat, min_lon, ""), Location(max_lat, max_lon, "")
+        return self._trip_fetches(corner, opposite, self.api, self.cache.get_or_fetch)['incidents']()
+
+    def calculate_route(self, start: Location, end: Location) -> Dict:
+        start, end = _as_location(start), _as_location(end)
+        return self._trip_fetches(start, end, self.api, self.cache.get_or_fetch)['routes']()
+
+    def cache_stats(self) -> Dict:
+        stats = self.cache.snapshot()
+        stats['flow_index'] = self.flow_index.snapshot()
+        stats['incident_index'] = self.incident_index.snapshot()
+        return stats
+
+def _as_location(value) -> Location:
+    # agents pass tool arguments as plain JSON
+    return value if isinstance(value, Location) else Location(value['lat'], value['lon'], value.get('name', ""))
+
+async def _resolve(value):
+    # fetches may answer synchronously (e.g. from flow_index) even on the async path
+    return await value if inspect.isawaitable(value) else value
+
+class CorridorRefresher:
+    """
+    Keeps a fixed set of popular origin/destination pairs warm by refreshing
+    them on a schedule from a daemon thread, so their users never wait on a
+    refetch. ``interval`` should be shorter than the smallest cache TTL.
+    """
+
+    def __init__(self, manager: TrafficDataManager, corridors: List[Tuple[Location, Location]],
+                 interval: float = 45.0):
+        self.manager = manager
+        self.corridors = list(corridors)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="corridor-refresher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        """Refresh every corridor once: flow at both ends, incidents and routes."""
+        for start, end in self.corridors:
+            if self._stop.is_set():
+                break
+            data = self.manager.refresh_trip(start, end)
+            if data.get('errors'):
+                print(f"Refreshing corridor {start.name} -> {end.name} failed: {data['errors']}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
 #just initialize serivces 
-tomtom = TomTomAPI(TOMTOM_API_KEY)
-traffic_manager = TrafficDataManager(tomtom)
-
-tools = [
-    Tool(
-        name="Get Traffic Flow", 
-        function=tomtom.get_traffic_flow, 
-        description="Get real-time traffic flow data."
-    ),
-    Tool(
-        name="Get Incidents", 
-        function=tomtom.get_incidents, 
-        description="Retrieve current traffic incidents."
-    ),
-    Tool(
-        name="Calculate Route", 
-        function=tomtom.calculate_route, 
-        description="Calculate the best route between two points."
-    ),
-    search_tool  
-]
-
-
-
-route_planner = Agent(
-    role='Route Planning Specialist',
-    goal='Plan optimal routes considering real-time conditions',
-    backstory="""You are an expert in route optimization with deep understanding 
-    of traffic patterns and routing algorithms. You analyze real-time data to 
-    suggest the best possible routes while considering multiple factors.""",
-    tools=tools,
-    verbose=True,
-    llm=llm
-)
-
-traffic_analyzer = Agent(
-    role='Traffic Pattern Analyst',
-    goal='Analyze traffic patterns and predict congestion',
-    backstory="""You are a traffic pattern specialist who excels at analyzing 
-    real-time traffic data and historical patterns. You can predict congestion 
-    and suggest timing adjustments for better travel experience.""",
-    tools=tools,
-    verbose=True,
-    llm=llm
-)
-
-safety_advisor = Agent(
-    role='Travel Safety Specialist',
-    goal='Provide safety recommendations and incident alerts',
-    backstory="""You are a safety expert specialized in traffic incident analysis 
-    and prevention. You provide crucial safety advice based on current conditions, 
-    weather, and reported incidents.""",
-    tools=tools,
-    verbose=True,
-    llm=llm
-)
-
-optimization_agent = Agent(
-    role='Journey Optimization Expert',
-    goal='Optimize overall journey experience',
-    backstory="""You are an expert in journey optimization who considers multiple 
-    factors like comfort, convenience, and user preferences. You provide 
-    comprehensive advice for the best possible travel experience.""",
-    verbose=True,
-    llm=llm
-)
-
-def create_navigation_tasks(start: Location, end: Location, user_preferences: Dict, traffic_data: Dict):
+# one scheduler for both clients, they draw from the same key's quota
+def _traffic_manager():
+    # set TRAFFIC_CACHE_PATH to keep cached TomTom data on disk across restarts
+    # and share it between worker processes on this host
+    cache_path = os.environ.get("TRAFFIC_CACHE_PATH")
+    return TrafficDataManager(
+        components.get("tomtom"),
+        cache=TrafficCache(
+            stale_ttls=DEFAULT_STALE_TTLS,
+            store=SQLiteCacheStore(cache_path) if cache_path else None
+        ),
+        async_api=components.get("async_tomtom")
+    )
+
+components.register("tomtom_scheduler", RequestScheduler)
+components.register("tomtom", lambda: TomTomAPI(
+    _env("TOMTOM_API_KEY"), scheduler=components.get("tomtom_scheduler")))
+components.register("async_tomtom", lambda: AsyncTomTomAPI(
+    _env("TOMTOM_API_KEY"), scheduler=components.get("tomtom_scheduler")))
+components.register("traffic_manager", _traffic_manager)
+
+# agents repeat the same tool calls within and across runs, and the data is
+# usually already cached for the trip; memoize them in the same cache
+TOOL_TTLS = {
+    "Get Traffic Flow": DEFAULT_TTLS["flow"],
+    "Get Incidents": DEFAULT_TTLS["incidents"],
+    "Calculate Route": DEFAULT_TTLS["routes"],
+    "Internet Search": 900,
+}
+
+def _search_tool():
+    from langchain.tools import DuckDuckGoSearchRun, StructuredTool
+    search = DuckDuckGoSearchRun()
+    return StructuredTool(
+        name="Internet Search",
+        # memoized like the TomTom tools
+        func=lambda query: components.get("tool_memo").call(
+            "Internet Search", TOOL_TTLS["Internet Search"], search.run, (query,)),
+        description="Search the internet for up-to-date information on traffic condition , real time incidents realted to the place in context asked by user",
+        args_schema=SearchInput  
+    )
+
+def _tools():
+    traffic_manager = components.get("traffic_manager")
+    tool_memo = components.get("tool_memo")
+    return [
+        Tool(
+            name="Get Traffic Flow", 
+            function=traffic_manager.get_traffic_flow, 
+            description="Get real-time traffic flow data.",
+            ttl=TOOL_TTLS["Get Traffic Flow"],
+            memo=tool_memo
+        ),
+        Tool(
+            name="Get Incidents", 
+            function=traffic_manager.get_incidents, 
+            description="Retrieve current traffic incidents.",
+            ttl=TOOL_TTLS["Get Incidents"],
+            memo=tool_memo
+        ),
+        Tool(
+            name="Calculate Route", 
+            function=traffic_manager.calculate_route, 
+            description="Calculate the best route between two points.",
+            ttl=TOOL_TTLS["Calculate Route"],
+            memo=tool_memo
+        ),
+        components.get("search_tool")  
+    ]
+
+components.register("tool_memo", lambda: ToolMemo(components.get("traffic_manager").cache))
+components.register("search_tool", _search_tool)
+components.register("tools", _tools)
+
+
+def _route_planner():
+    from crewai import Agent
+    return Agent(
+        role='Route Planning Specialist',
+        goal='Plan optimal routes considering real-time conditions',
+        backstory="""You are an expert in route optimization with deep understanding 
+        of traffic patterns and routing algorithms. You analyze real-time data to 
+        suggest the best possible routes while considering multiple factors.""",
+        tools=components.get("tools"),
+        verbose=True,
+        llm=components.get("llm")
+    )
+
+def _traffic_analyzer():
+    from crewai import Agent
+    return Agent(
+        role='Traffic Pattern Analyst',
+        goal='Analyze traffic patterns and predict congestion',
+        backstory="""You are a traffic pattern specialist who excels at analyzing 
+        real-time traffic data and historical patterns. You can predict congestion 
+        and suggest timing adjustments for better travel experience.""",
+        tools=components.get("tools"),
+        verbose=True,
+        llm=components.get("llm")
+    )
+
+def _safety_advisor():
+    from crewai import Agent
+    return Agent(
+        role='Travel Safety Specialist',
+        goal='Provide safety recommendations and incident alerts',
+        backstory="""You are a safety expert specialized in traffic incident analysis 
+        and prevention. You provide crucial safety advice based on current conditions, 
+        weather, and reported incidents.""",
+        tools=components.get("tools"),
+        verbose=True,
+        llm=components.get("llm")
+    )
+
+def _optimization_agent():
+    from crewai import Agent
+    return Agent(
+        role='Journey Optimization Expert',
+        goal='Optimize overall journey experience',
+        backstory="""You are an expert in journey optimization who considers multiple 
+        factors like comfort, convenience, and user preferences. You provide 
+        comprehensive advice for the best possible travel experience.""",
+        verbose=True,
+        llm=components.get("llm")
+    )
+
+components.register("route_planner", _route_planner)
+components.register("traffic_analyzer", _traffic_analyzer)
+components.register("safety_advisor", _safety_advisor)
+components.register("optimization_agent", _optimization_agent)
+
+def __getattr__(name):
+    # main.tomtom, main.llm, main.route_planner, ... are built on first access
+    if name in components:
+        return components.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def create_navigation_tasks(start: Location, end: Location, user_preferences: Dict, traffic_data: Dict,
+                            payload: Optional[PromptPayload] = None):
+    from crewai import Task
+    # compact summaries instead of the raw TomTom JSON, built once for all tasks
+    payload = payload or PromptPayload(traffic_data)
+    preferences = json.dumps(user_preferences, separators=(",", ":"))
     bbox = f"{min(start.lon, end.lon)},{min(start.lat, end.lat)}," \
            f"{max(start.lon, end.lon)},{max(start.lat, end.lat)}"
-    # traffic_data = traffic_manager.get_current_traffic_situation(start, end)
+    # traffic_data = components.get("traffic_manager").get_current_traffic_situation(start, end)
 
     route_planning_task = Task(
         description=f"""Analyze routes and provide optimal path recommendations:
         Start: {json.dumps(start.__dict__)}
         End: {json.dumps(end.__dict__)}
-        Current Traffic Data: {json.dumps(traffic_data)}
-        User Preferences: {json.dumps(user_preferences)}
+        {payload.for_task("route_planning")}
+        User Preferences: {preferences}
         
         1. Evaluate all possible routes
         2. Consider real-time traffic conditions
         3. Account for user preferences
         4. Provide top 3 route recommendations with reasoning""",
-        agent=route_planner,
+        agent=components.get("route_planner"),
         expected_output="A list of 3 recommended routes with detailed explanations for each, considering traffic conditions and user preferences."
     )
 
     traffic_analysis_task = Task(
         description=f"""Analyze traffic patterns and provide insights:
-        Traffic Data: {json.dumps(traffic_data)}
+        {payload.for_task("traffic_analysis")}
         Time: {datetime.now().isoformat()}
         
         1. Identify current congestion patterns
         2. Predict upcoming traffic changes
         3. Suggest optimal departure times
         4. Highlight areas to avoid""",
-        agent=traffic_analyzer,
+        agent=components.get("traffic_analyzer"),
         expected_output="A comprehensive traffic analysis report including current congestion patterns, predicted changes, optimal departure times, and areas to avoid."
     )
 
     safety_task = Task(
         description=f"""Provide safety analysis and recommendations:
-        Incidents: {json.dumps(traffic_data['incidents'])}
-        Route Data: {json.dumps(traffic_data['routes'])}
+        {payload.for_task("safety")}
         
         1. Analyze current incidents and hazards
         2. Identify high-risk areas along routes
         3. Provide safety recommendations
         4. Suggest emergency alternatives""",
-        agent=safety_advisor,
+        agent=components.get("safety_advisor"),
         expected_output="A safety report detailing current incidents, high-risk areas, safety recommendations, and emergency alternatives for the journey."
     )
 
-    optimization_task = Task(
+    optimization_task = create_optimization_task(user_preferences, traffic_data, payload=payload)
+
+    return [route_planning_task, traffic_analysis_task, safety_task, optimization_task]
+
+def create_optimization_task(user_preferences: Dict, traffic_data: Dict,
+                             findings: Optional[Dict[str, str]] = None,
+                             payload: Optional[PromptPayload] = None):
+    """
+    The journey optimization task. ``findings`` are the outputs of the three
+    specialist tasks; when given they are handed to the agent explicitly,
+    since in the parallel run there is no sequential context to inherit.
+    Each finding is cut to ``FINDING_TOKEN_BUDGET`` so the prompt fits the context.
+    """
+    from crewai import Task
+    payload = payload or PromptPayload(traffic_data)
+    specialist_findings = ""
+    if findings:
+        specialist_findings = "\n        Specialist Findings:\n" + "\n".join(
+            f"        [{name}]\n{truncate_to_budget(str(output), FINDING_TOKEN_BUDGET)}"
+            for name, output in findings.items()
+        ) + "\n"
+
+    return Task(
         description=f"""Optimize overall journey experience:
-        Route Options: {json.dumps(traffic_data['routes'])}
-        Traffic Analysis: {json.dumps(traffic_data)}
-        User Preferences: {json.dumps(user_preferences)}
-        
+        {payload.for_task("journey_optimization")}
+        User Preferences: {json.dumps(user_preferences, separators=(",", ":"))}
+        {specialist_findings}
         1. Consider comfort factors
         2. Evaluate route stress levels
         3. Suggest breaks and points of interest
         4. Provide comprehensive journey optimization""",
-        agent=optimization_agent,
+        agent=components.get("optimization_agent"),
         expected_output="A detailed journey optimization plan including comfort considerations, stress reduction strategies, recommended breaks, and points of interest along the route."
 
     )
 
-    return [route_planning_task, traffic_analysis_task, safety_task, optimization_task]
+# specialist outputs can be up to max_tokens each; cap what is fed forward
+FINDING_TOKEN_BUDGET = 500
+
+# route planning, traffic analysis and safety only read the traffic data, so
+# they can run side by side; journey optimization combines their outputs
+NAVIGATION_STAGES = ["route_planning", "traffic_analysis", "safety"]
+
+def _run_task(task, stage: Optional[str] = None,
+              on_token: Optional[Callable[[str, str], None]] = None) -> str:
+    from crewai import Crew, Process
+    crew = Crew(agents=[task.agent], tasks=[task], process=Process.sequential)
+    if on_token is None:
+        return crew.kickoff()
+    # the task runs in this thread, so its LLM tokens land in this sink
+    with components.get("token_stream").sink(lambda token: on_token(stage, token)):
+        return crew.kickoff()
+
+def run_navigation_crew(start: Location, end: Location, user_preferences: Dict,
+                        traffic_data: Dict,
+                        on_result: Optional[Callable[[str, str], None]] = None,
+                        on_token: Optional[Callable[[str, str], None]] = None) -> Dict[str, str]:
+    """
+    Run the navigation tasks as a DAG: the three specialist tasks concurrently,
+    then journey optimization on their outputs. Wall-clock time is roughly the
+    slowest specialist plus one LLM turn instead of the sum of all four.
+
+    ``on_result(stage, output)`` is called as each task finishes and
+    ``on_token(stage, token)`` for every streamed LLM token.
+    Returns each task's output keyed by stage name, ending with "journey_optimization".
+    """
+    payload = PromptPayload(traffic_data)
+    tasks = create_navigation_tasks(start, end, user_preferences, traffic_data, payload=payload)
+    stages = dict(zip(NAVIGATION_STAGES, tasks))
+
+    with ThreadPoolExecutor(max_workers=len(stages), thread_name_prefix="crew") as pool:
+        futures = {pool.submit(_run_task, task, name, on_token): name for name, task in stages.items()}
+        for future in as_completed(futures):
+            if on_result is not None:
+                on_result(futures[future], future.result())
+        results = {name: future.result() for future, name in futures.items()}
 
-def run_navigation_system(start: Location, end: Location, user_preferences: Dict):
-    tasks = create_navigation_tasks(start, end, user_preferences)
-    crew = Crew(
-        agents=[route_planner, traffic_analyzer, safety_advisor, optimization_agent],
-        tasks=tasks,
-        process=Process.sequential
+    optimization_task = create_optimization_task(user_preferences, traffic_data,
+                                                 findings=results, payload=payload)
+    results["journey_optimization"] = _run_task(optimization_task, "journey_optimization", on_token)
+    if on_result is not None:
+        on_result("journey_optimization", results["journey_optimization"])
+    return results
+
+def _crew_events(start: Location, end: Location, user_preferences: Dict, traffic_data: Dict,
+                 tokens: bool) -> Callable[[Callable[[Dict], None]], None]:
+    """The crew run as a producer of stream events, for streaming.stream_from_thread."""
+    def run(emit):
+        run_navigation_crew(
+            start, end, user_preferences, traffic_data,
+            on_result=lambda stage, output: emit({"type": "result", "stage": stage, "text": output}),
+            on_token=(lambda stage, token: emit({"type": "token", "stage": stage, "text": token}))
+            if tokens else None
+        )
+    return run
+
+def format_navigation_results(results: Dict[str, str]) -> str:
+    return "\n\n".join(
+        f"== {name.replace('_', ' ').title()} ==\n{output}" for name, output in results.items()
     )
-    return crew.kickoff()
+
+# "fast" answers with the deterministic route ranking only, "full" adds the crew analysis
+NAVIGATION_MODES = ("fast", "full")
+
+def _check_mode(mode: str):
+    if mode not in NAVIGATION_MODES:
+        raise ValueError(f"unknown navigation mode {mode!r}, expected one of {NAVIGATION_MODES}")
+
+def run_navigation_system(start: Location, end: Location, user_preferences: Dict, mode: str = "full"):
+    """
+    Results keyed by stage name, starting with "route_ranking" (see
+    route_scorer.py). In "fast" mode that is all, and no LLM call is made.
+    """
+    _check_mode(mode)
+    traffic_data = components.get("traffic_manager").get_current_traffic_situation(start, end)
+    results = {"route_ranking": format_route_ranking(score_routes(traffic_data, user_preferences))}
+    if mode == "full":
+        results.update(run_navigation_crew(start, end, user_preferences, traffic_data))
+    return results
+
+async def run_navigation_system_async(start: Location, end: Location, user_preferences: Dict,
+                                      mode: str = "full"):
+    """
+    Async entry point: TomTom data is fetched on the event loop, the blocking
+    crew run is pushed to a worker thread so the loop keeps serving other trips.
+    """
+    _check_mode(mode)
+    traffic_data = await components.get("traffic_manager").get_current_traffic_situation_async(start, end)
+    results = {"route_ranking": format_route_ranking(score_routes(traffic_data, user_preferences))}
+    if mode == "full":
+        results.update(await asyncio.to_thread(run_navigation_crew, start, end, user_preferences, traffic_data))
+    return results
+
+def stream_navigation(start: Location, end: Location, user_preferences: Dict, mode: str = "full",
+                      tokens: bool = False):
+    """
+    Generator version of ``run_navigation_system``: yields
+    ``{"type": "result", "stage": ..., "text": ...}`` for the route ranking
+    right away and for each crew task as soon as it finishes. With ``tokens``
+    the LLM output is also streamed as ``{"type": "token", ...}`` events;
+    the three specialist stages run at once, so tokens of different stages interleave.
+    """
+    _check_mode(mode)
+    traffic_data = components.get("traffic_manager").get_current_traffic_situation(start, end)
+    yield {"type": "result", "stage": "route_ranking",
+           "text": format_route_ranking(score_routes(traffic_data, user_preferences))}
+    if mode == "full":
+        from streaming import stream_from_thread
+        yield from stream_from_thread(_crew_events(start, end, user_preferences, traffic_data, tokens))
+
+async def stream_navigation_async(start: Location, end: Location, user_preferences: Dict,
+                                  mode: str = "full", tokens: bool = False):
+    """Async iterator version of ``stream_navigation``."""
+    _check_mode(mode)
+    traffic_data = await components.get("traffic_manager").get_current_traffic_situation_async(start, end)
+    yield {"type": "result", "stage": "route_ranking",
+           "text": format_route_ranking(score_routes(traffic_data, user_preferences))}
+    if mode == "full":
+        from streaming import astream_from_thread
+        async for event in astream_from_thread(_crew_events(start, end, user_preferences, traffic_data, tokens)):
+            yield event
+
+# importing this module (without building any component) should stay under
+# this; check with `python main.py --startup`
+STARTUP_BUDGET_S = 0.5
+IMPORT_TIME_S = time.perf_counter() - _import_started
+
+def startup_report() -> Dict:
+    """Module import time against the budget, plus build times of the components built so far."""
+    return {
+        "import_s": round(IMPORT_TIME_S, 4),
+        "budget_s": STARTUP_BUDGET_S,
+        "within_budget": IMPORT_TIME_S <= STARTUP_BUDGET_S,
+        "components_s": {name: round(t, 4) for name, t in components.timings().items()},
+    }
 
 if __name__ == "__main__":
+    if "--startup" in sys.argv:
+        # build what a navigation run needs, without calling TomTom or the LLM
+        for name in ("traffic_manager", "llm", "route_planner", "traffic_analyzer",
+                     "safety_advisor", "optimization_agent"):
+            components.get(name)
+        report = startup_report()
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["within_budget"] else 1)
+
     start_location = Location(40.7128, -74.0060, "Manhattan")
     end_location = Location(40.6782, -73.9442, "Brooklyn")
     
@@ -355,23 +1209,11 @@ if __name__ == "__main__":
     
     try:
         print("Starting Smart Traffic Navigation System...")
-        tomtom_api = TomTomAPI(TOMTOM_API_KEY)
-        traffic_manager = TrafficDataManager(tomtom_api)
-        
-        # Get current traffic situation
-        traffic_data = traffic_manager.get_current_traffic_situation(start_location, end_location)
         
-        # Create navigation tasks using the traffic data
-        tasks = create_navigation_tasks(start_location, end_location, user_preferences, traffic_data)
-        
-        crew = Crew(
-            agents=[route_planner, traffic_analyzer, safety_advisor, optimization_agent],
-            tasks=tasks,
-            process=Process.sequential
-        )
-        results = crew.kickoff()
+        # Print each recommendation as soon as its task is done
         print("\nNavigation Recommendations:")
-        print(results)
+        for event in stream_navigation(start_location, end_location, user_preferences):
+            print(format_navigation_results({event["stage"]: event["text"]}) + "\n")
         
     except Exception as e:
         print(f"Error occurred: {str(e)}")
\ No newline at end of file
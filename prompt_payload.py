@@ -0,0 +1,130 @@
+import json
+from typing import Dict, List, Optional
+
+# rough budget of prompt tokens each task may spend on traffic data; the
+# model has an 8k context shared with the agent's own prompt and its output
+DEFAULT_TASK_BUDGETS = {
+    "route_planning": 900,
+    "traffic_analysis": 900,
+    "safety": 700,
+    "journey_optimization": 700,
+}
+
+# which sections each task gets, in order of importance
+TASK_SECTIONS = {
+    "route_planning": ["routes", "flow", "incidents"],
+    "traffic_analysis": ["flow", "incidents", "routes"],
+    "safety": ["incidents", "routes"],
+    "journey_optimization": ["routes", "flow", "incidents"],
+}
+
+# sections are joined onto the indented lines of the task descriptions
+SEPARATOR = "\n        "
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English and compact JSON
+    return len(text) // 4 + 1
+
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    if estimate_tokens(text) <= budget:
+        return text
+    return text[:budget * 4].rsplit(" ", 1)[0] + " ...[truncated]"
+
+
+def _minutes(seconds) -> float:
+    return round((seconds or 0) / 60, 1)
+
+
+def _route_stats(summary: Dict) -> Dict:
+    return {
+        "km": round(summary.get("lengthInMeters", 0) / 1000, 1),
+        "eta_min": _minutes(summary.get("travelTimeInSeconds")),
+        "delay_min": _minutes(summary.get("trafficDelayInSeconds")),
+    }
+
+
+def summarize_routes(routes: Dict) -> List[Dict]:
+    """One compact record per TomTom route: totals plus per-leg stats, no geometry."""
+    summaries = []
+    for i, route in enumerate(routes.get("routes", []) if isinstance(routes, dict) else []):
+        record = {"route": i + 1, **_route_stats(route.get("summary", {}))}
+        legs = route.get("legs", [])
+        if len(legs) > 1:
+            record["legs"] = [_route_stats(leg.get("summary", {})) for leg in legs]
+        summaries.append(record)
+    return summaries
+
+
+def summarize_incident(incident: Dict) -> str:
+    loc = incident.get("location", {})
+    line = (f"{incident.get('type', 'Unknown')} sev{incident.get('severity', 0)} "
+            f"+{_minutes(incident.get('delay'))}min @{loc.get('lat', 0):.4f},{loc.get('lon', 0):.4f}")
+    if loc.get("name"):
+        line += f" {loc['name']}"
+    if incident.get("description"):
+        line += f": {incident['description']}"
+    return line
+
+
+def summarize_flow(flow: Optional[Dict]) -> str:
+    if not flow:
+        return "no data"
+    current, free = flow.get("current_speed", 0), flow.get("free_flow_speed", 0)
+    ratio = round(current / free, 2) if free else 0
+    return f"{current}/{free} km/h (ratio {ratio})"
+
+
+class PromptPayload:
+    """
+    Compact, prompt-ready view of ``TrafficDataManager`` output.
+
+    Each section (routes, flow, incidents) is summarized and serialized once;
+    ``for_task`` then assembles the sections a task needs within that task's
+    token budget, dropping the least severe incidents first.
+    """
+
+    def __init__(self, traffic_data: Dict, budgets: Optional[Dict[str, int]] = None):
+        self.budgets = dict(DEFAULT_TASK_BUDGETS, **(budgets or {}))
+        self.sections = {
+            "routes": "Routes: " + json.dumps(summarize_routes(traffic_data.get("routes") or {}),
+                                              separators=(",", ":")),
+            "flow": (f"Flow: start {summarize_flow(traffic_data.get('start_traffic'))}; "
+                     f"end {summarize_flow(traffic_data.get('end_traffic'))}"),
+        }
+        incidents = sorted(traffic_data.get("incidents") or [],
+                           key=lambda i: (i.get("severity", 0), i.get("delay", 0)), reverse=True)
+        self._incident_lines = [summarize_incident(i) for i in incidents]
+        self.sections["incidents"] = self._incidents_text(len(self._incident_lines))
+        errors = traffic_data.get("errors")
+        self.data_gaps = ("Data gaps (treat as unknown): " + ", ".join(sorted(errors))) if errors else ""
+
+    def _incidents_text(self, count: int) -> str:
+        if not self._incident_lines:
+            return "Incidents: none reported"
+        text = "Incidents:\n" + "\n".join(f"- {line}" for line in self._incident_lines[:count])
+        omitted = len(self._incident_lines) - count
+        if omitted:
+            text += f"\n- (+{omitted} less severe incidents omitted)"
+        return text
+
+    def for_task(self, task: str) -> str:
+        budget = self.budgets[task]
+        parts = [self.sections[name] for name in TASK_SECTIONS[task] if name != "incidents"]
+        if self.data_gaps:
+            parts.append(self.data_gaps)
+        # every part costs its text plus the joining newline/indent
+        used = sum(estimate_tokens(p + SEPARATOR) for p in parts)
+
+        if "incidents" in TASK_SECTIONS[task]:
+            incidents = self.sections["incidents"]
+            if used + estimate_tokens(incidents + SEPARATOR) > budget:
+                # keep as many of the most severe incidents as fit
+                count = len(self._incident_lines)
+                while count > 0 and used + estimate_tokens(self._incidents_text(count) + SEPARATOR) > budget:
+                    count -= 1
+                incidents = self._incidents_text(count)
+            parts.insert(TASK_SECTIONS[task].index("incidents"), incidents)
+
+        return SEPARATOR.join(parts)
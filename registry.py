@@ -0,0 +1,65 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class Registry:
+    """
+    Named, lazily built shared components.
+
+    ``register`` records a factory; the first ``get`` builds the component
+    (once, even with concurrent callers) and later calls return the same
+    instance. Factories may ``get`` other components. Build times are kept
+    so startup cost can be checked with ``timings``.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._timings: Dict[str, float] = {}
+        # reentrant so factories can pull in their dependencies
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._instances:
+                if name not in self._factories:
+                    raise KeyError(f"no component registered as {name!r}")
+                started = time.perf_counter()
+                self._instances[name] = self._factories[name]()
+                self._timings[name] = time.perf_counter() - started
+            return self._instances[name]
+
+    def set(self, name: str, instance: Any):
+        """Use an already built instance, e.g. a client configured by the caller."""
+        with self._lock:
+            self._factories.setdefault(name, lambda: instance)
+            self._instances[name] = instance
+
+    def reset(self, name: Optional[str] = None):
+        """Forget built instances so the next ``get`` rebuilds them."""
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+    def is_built(self, name: str) -> bool:
+        return name in self._instances
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._factories
+
+    def timings(self) -> Dict[str, float]:
+        """Seconds each built component took, including the components it pulled in."""
+        with self._lock:
+            return dict(self._timings)
@@ -0,0 +1,143 @@
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from geometry import decode_polyline, points_to_polyline_m
+
+# same thresholds as the Pathway pipeline (pipeline_2.py): only events of
+# severity 2+ count, severity 4 is critical
+MIN_EVENT_SEVERITY = 2
+# an incident this close to a route's geometry is on that route
+INCIDENT_RADIUS_M = 150
+
+# weight of the risk term relative to (normalized) travel time
+SAFETY_WEIGHTS = {"low": 0.25, "medium": 0.5, "high": 1.0}
+PRIORITY_RISK_FACTORS = {"fastest": 0.5, "balanced": 1.0, "safest": 2.0}
+
+
+@dataclass
+class RouteScore:
+    route: int
+    rank: int
+    km: float
+    eta_min: float
+    adjusted_eta_min: float
+    congestion_index: float
+    event_count: int
+    max_severity: int
+    risk_score: float
+    recommendation: str
+    score: float
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _speed_ratio(flow: Optional[Dict]) -> Optional[float]:
+    if not flow or not flow.get("free_flow_speed"):
+        return None
+    return min(1.0, flow["current_speed"] / flow["free_flow_speed"])
+
+
+def _route_polyline(route: Dict) -> np.ndarray:
+    points = []
+    for leg in route.get("legs", []):
+        if leg.get("encodedPolyline"):
+            points.extend(decode_polyline(leg["encodedPolyline"]))
+        elif leg.get("points"):
+            points.extend((p["latitude"], p["longitude"]) for p in leg["points"])
+    return np.array(points, dtype=float).reshape(-1, 2)
+
+
+def _route_events(route: Dict, incident_points: np.ndarray) -> np.ndarray:
+    """Mask of the incidents that lie on the route (all of them when it has no geometry)."""
+    polyline = _route_polyline(route)
+    if not len(polyline) or not len(incident_points):
+        return np.ones(len(incident_points), dtype=bool)
+    return points_to_polyline_m(incident_points, polyline) <= INCIDENT_RADIUS_M
+
+
+def score_routes(traffic_data: Dict, user_preferences: Optional[Dict] = None) -> List[RouteScore]:
+    """
+    Rank the TomTom route alternatives in ``traffic_data`` (the output of
+    ``TrafficDataManager``) without calling the LLM.
+
+    Per route, with the signals of ``SmartRoutingEngine``: the congestion
+    index (speed over free-flow speed, from the route's traffic delay and the
+    flow at both ends), the count and max severity of the incidents on it,
+    ``adjusted ETA = free-flow time * (2 - congestion index)`` and a risk
+    score. TomTom's travel time already includes the traffic delay, so the
+    congestion penalty goes on the free-flow time to count the slowdown once.
+    Routes are ordered by normalized adjusted ETA plus the risk score weighted
+    by ``safety_priority`` and ``priority`` from ``user_preferences``.
+    """
+    user_preferences = user_preferences or {}
+    routes = (traffic_data.get("routes") or {}).get("routes", [])
+    if not routes:
+        return []
+
+    events = [i for i in traffic_data.get("incidents") or [] if i.get("severity", 0) >= MIN_EVENT_SEVERITY]
+    incident_points = np.array([[i["location"]["lat"], i["location"]["lon"]] for i in events],
+                               dtype=float).reshape(-1, 2)
+    severities = np.array([i["severity"] for i in events], dtype=int)
+    endpoint_ratios = [r for r in (_speed_ratio(traffic_data.get("start_traffic")),
+                                   _speed_ratio(traffic_data.get("end_traffic"))) if r is not None]
+
+    summaries = [route.get("summary", {}) for route in routes]
+    travel = np.array([s.get("travelTimeInSeconds", 0) for s in summaries], dtype=float)
+    km = np.array([s.get("lengthInMeters", 0) / 1000 for s in summaries], dtype=float)
+    # TomTom only reports the no-traffic time when asked for it (computeTravelTimeFor=all)
+    free_flow = np.array([s.get("noTrafficTravelTimeInSeconds", s.get("travelTimeInSeconds", 0)
+                                - s.get("trafficDelayInSeconds", 0)) for s in summaries], dtype=float)
+    free_flow = np.clip(free_flow, 0, None)
+
+    # free-flow time over actual time is the route-wide speed ratio
+    route_ratio = np.where(travel > 0, free_flow / np.where(travel > 0, travel, 1), 1.0)
+    congestion = (route_ratio + sum(endpoint_ratios)) / (1 + len(endpoint_ratios))
+    congestion = np.clip(congestion, 0, 1)
+    adjusted = free_flow * (1 + (1 - congestion))
+
+    on_route = [_route_events(route, incident_points) for route in routes]
+    event_count = np.array([mask.sum() for mask in on_route], dtype=int)
+    max_severity = np.array([severities[mask].max() if mask.any() else 0 for mask in on_route], dtype=int)
+    risk = np.select([max_severity >= 4, max_severity >= 2], [1.0, 0.5], 0.0)
+
+    risk_weight = (SAFETY_WEIGHTS.get(user_preferences.get("safety_priority"), SAFETY_WEIGHTS["medium"])
+                   * PRIORITY_RISK_FACTORS.get(user_preferences.get("priority"), 1.0))
+    fastest = adjusted.min() if adjusted.min() > 0 else 1.0
+    score = adjusted / fastest + risk_weight * (risk + 0.1 * event_count)
+
+    recommendation = np.select(
+        [(congestion < 0.6) | (event_count > 1), risk > 0.5],
+        ["FIND_ALTERNATIVE", "CAUTION_ADVISED"], "ROUTE_OK"
+    )
+
+    order = np.argsort(score, kind="stable")
+    return [
+        RouteScore(
+            route=int(i) + 1,
+            rank=rank,
+            km=round(float(km[i]), 1),
+            eta_min=round(float(travel[i]) / 60, 1),
+            adjusted_eta_min=round(float(adjusted[i]) / 60, 1),
+            congestion_index=round(float(congestion[i]), 2),
+            event_count=int(event_count[i]),
+            max_severity=int(max_severity[i]),
+            risk_score=float(risk[i]),
+            recommendation=str(recommendation[i]),
+            score=round(float(score[i]), 3),
+        )
+        for rank, i in enumerate(order, start=1)
+    ]
+
+
+def format_route_ranking(scores: List[RouteScore]) -> str:
+    if not scores:
+        return "No routes available."
+    return "\n".join(
+        f"{s.rank}. Route {s.route}: {s.km} km, ETA {s.eta_min} min "
+        f"(adjusted {s.adjusted_eta_min} min), congestion {s.congestion_index}, "
+        f"{s.event_count} incidents (max severity {s.max_severity}) - {s.recommendation}"
+        for s in scores
+    )
@@ -0,0 +1,233 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple
+
+# priority lanes, lower is served first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+class SchedulerError(Exception):
+    pass
+
+
+class DeadlineExceeded(SchedulerError):
+    """The request waited in the queue longer than its deadline."""
+
+
+class QuotaExhausted(SchedulerError):
+    """The daily quota for an endpoint family is used up."""
+
+
+@dataclass
+class FamilyLimits:
+    qps: float
+    burst: int
+    daily_quota: Optional[int] = None
+
+
+# conservative defaults below TomTom's per-second limits; the daily quota
+# depends on the plan so it is off unless configured
+DEFAULT_LIMITS = {
+    "flow": FamilyLimits(qps=10, burst=20),
+    "incidents": FamilyLimits(qps=5, burst=10),
+    "routing": FamilyLimits(qps=5, burst=10),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = now
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def time_until_available(self, now: float) -> float:
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, until: float):
+        self.paused_until = max(self.paused_until, until)
+
+
+@dataclass
+class FamilyMetrics:
+    granted: int = 0
+    expired: int = 0
+    rejected: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    daily_used: int = 0
+    day: str = ""
+
+
+class RequestScheduler:
+    """
+    Client-side rate limiter for TomTom requests.
+
+    Each endpoint family (flow, incidents, routing) has its own token bucket
+    and a priority queue of waiters: a waiter only gets a token when it is at
+    the head of its family queue, so interactive requests always go before
+    background prefetch. Waiters give up with ``DeadlineExceeded`` after
+    ``timeout`` seconds, and a configured daily quota raises ``QuotaExhausted``
+    up front instead of letting TomTom answer 429.
+    """
+
+    # how often async waiters that are not at the head of the queue re-check
+    ASYNC_POLL_INTERVAL = 0.05
+
+    def __init__(self, limits: Optional[Dict[str, FamilyLimits]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.clock = clock
+        now = clock()
+        self._buckets = {family: TokenBucket(l.qps, l.burst, now) for family, l in self.limits.items()}
+        self._queues: Dict[str, list] = {family: [] for family in self.limits}
+        self._metrics = {family: FamilyMetrics() for family in self.limits}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, family: str, priority: int = INTERACTIVE, timeout: Optional[float] = None) -> float:
+        """Block until a request of ``family`` may be sent. Returns the time spent waiting."""
+        start = self.clock()
+        with self._cond:
+            ticket = self._enqueue(family, priority)
+            try:
+                while True:
+                    granted, sleep_for = self._poll(family, ticket, start, timeout)
+                    if granted:
+                        return self.clock() - start
+                    self._cond.wait(sleep_for)
+            except BaseException:
+                self._dequeue(family, ticket)
+                raise
+
+    async def acquire_async(self, family: str, priority: int = INTERACTIVE,
+                            timeout: Optional[float] = None) -> float:
+        """Non-blocking variant of ``acquire`` for the event loop."""
+        start = self.clock()
+        with self._cond:
+            ticket = self._enqueue(family, priority)
+        try:
+            while True:
+                with self._cond:
+                    granted, sleep_for = self._poll(family, ticket, start, timeout)
+                if granted:
+                    return self.clock() - start
+                await asyncio.sleep(self.ASYNC_POLL_INTERVAL if sleep_for is None
+                                    else min(sleep_for, self.ASYNC_POLL_INTERVAL))
+        except BaseException:
+            with self._cond:
+                self._dequeue(family, ticket)
+            raise
+
+    def penalize(self, family: str, seconds: float):
+        """Stop granting ``family`` tokens for a while, e.g. after a 429 with Retry-After."""
+        with self._cond:
+            self._buckets[family].pause(self.clock() + seconds)
+
+    def metrics(self) -> Dict:
+        with self._cond:
+            data = {}
+            for family, m in self._metrics.items():
+                depth = {name: 0 for name in PRIORITY_NAMES.values()}
+                for priority, _ in self._queues[family]:
+                    depth[PRIORITY_NAMES.get(priority, str(priority))] += 1
+                data[family] = {
+                    "queue_depth": depth,
+                    "granted": m.granted,
+                    "expired": m.expired,
+                    "rejected": m.rejected,
+                    "avg_wait_ms": 1000 * m.total_wait / m.granted if m.granted else 0.0,
+                    "max_wait_ms": 1000 * m.max_wait,
+                    "daily_used": m.daily_used,
+                    "daily_quota": self.limits[family].daily_quota,
+                }
+            return data
+
+    # -- internals, all called with self._cond held --
+
+    def _enqueue(self, family: str, priority: int) -> Tuple[int, int]:
+        if family not in self._buckets:
+            raise KeyError(f"unknown endpoint family: {family}")
+        self._check_quota(family)
+        ticket = (priority, next(self._seq))
+        heapq.heappush(self._queues[family], ticket)
+        return ticket
+
+    def _dequeue(self, family: str, ticket: Tuple[int, int]):
+        queue = self._queues[family]
+        if ticket in queue:
+            queue.remove(ticket)
+            heapq.heapify(queue)
+            self._cond.notify_all()
+
+    def _poll(self, family: str, ticket: Tuple[int, int], start: float,
+              timeout: Optional[float]) -> Tuple[bool, Optional[float]]:
+        """
+        Try to grant ``ticket`` a token. Returns ``(granted, sleep_for)``, where
+        ``sleep_for`` is how long to wait before trying again (None: until notified).
+        """
+        now = self.clock()
+        queue = self._queues[family]
+        sleep_for = None
+        if queue[0] == ticket:
+            bucket = self._buckets[family]
+            sleep_for = bucket.time_until_available(now)
+            if sleep_for <= 0:
+                self._check_quota(family)
+                heapq.heappop(queue)
+                bucket.take(now)
+                self._record_grant(family, now - start)
+                self._cond.notify_all()
+                return True, None
+        if timeout is not None:
+            remaining = start + timeout - now
+            if remaining <= 0:
+                self._metrics[family].expired += 1
+                raise DeadlineExceeded(f"{family} request waited more than {timeout}s for a rate limit slot")
+            sleep_for = remaining if sleep_for is None else min(sleep_for, remaining)
+        return False, sleep_for
+
+    def _check_quota(self, family: str):
+        quota = self.limits[family].daily_quota
+        if quota is None:
+            return
+        m = self._roll_day(family)
+        if m.daily_used >= quota:
+            m.rejected += 1
+            raise QuotaExhausted(f"daily {family} quota of {quota} requests is used up")
+
+    def _roll_day(self, family: str) -> FamilyMetrics:
+        m = self._metrics[family]
+        today = datetime.now(timezone.utc).date().isoformat()
+        if m.day != today:
+            m.day, m.daily_used = today, 0
+        return m
+
+    def _record_grant(self, family: str, waited: float):
+        m = self._roll_day(family)
+        m.granted += 1
+        m.daily_used += 1
+        m.total_wait += waited
+        m.max_wait = max(m.max_wait, waited)
@@ -0,0 +1,243 @@
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+import main
+from main import Location, NAVIGATION_MODES, components, run_navigation_system, startup_report
+
+MAX_BODY_BYTES = 64 * 1024
+
+
+class ServiceMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def count(self, field: str, delta: int = 1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self.completed += 1
+            self.total_latency += seconds
+            self.max_latency = max(self.max_latency, seconds)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "uptime_s": round(time.time() - self.started, 1),
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "avg_latency_ms": round(1000 * self.total_latency / self.completed, 1) if self.completed else 0.0,
+                "max_latency_ms": round(1000 * self.max_latency, 1),
+            }
+
+
+class NavigationService:
+    """
+    Serves navigation requests from one long-lived process, so the TomTom
+    session, caches, LLM client and agents are built once and stay warm.
+
+    At most ``max_workers`` navigations run at once; a request that cannot
+    get a worker within ``queue_timeout`` seconds is rejected (503), and one
+    that takes longer than ``request_timeout`` gets a 504 while its run
+    finishes in the background (and still fills the caches). Request bodies
+    above ``max_body_bytes`` are refused (413).
+    """
+
+    def __init__(self, max_workers: int = 4, queue_timeout: float = 5.0, request_timeout: float = 120.0,
+                 max_body_bytes: int = MAX_BODY_BYTES):
+        self.max_workers = max_workers
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.max_body_bytes = max_body_bytes
+        self.metrics = ServiceMetrics()
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="navigate")
+
+    def warm(self, full: bool = True):
+        """Build the shared components up front instead of on the first request."""
+        names = ["traffic_manager"]
+        if full:
+            names += ["llm", "route_planner", "traffic_analyzer", "safety_advisor", "optimization_agent"]
+        for name in names:
+            components.get(name)
+
+    def navigate(self, request: Dict) -> Tuple[int, Dict]:
+        """``(status, body)`` for a /navigate request body."""
+        try:
+            start = _parse_location(request.get("start"), "start")
+            end = _parse_location(request.get("end"), "end")
+            preferences = request.get("preferences") or {}
+            mode = request.get("mode", "full")
+            if not isinstance(preferences, dict):
+                raise ValueError("preferences must be an object")
+            if mode not in NAVIGATION_MODES:
+                raise ValueError(f"mode must be one of {list(NAVIGATION_MODES)}")
+        except (ValueError, TypeError, AttributeError) as e:
+            return 400, {"error": str(e)}
+
+        self.metrics.count("requests")
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.metrics.count("rejected")
+            return 503, {"error": f"all {self.max_workers} workers busy, try again later"}
+
+        self.metrics.count("in_flight")
+        started = time.perf_counter()
+        future = self._executor.submit(run_navigation_system, start, end, preferences, mode)
+
+        def release(_):
+            self.metrics.count("in_flight", -1)
+            self._slots.release()
+        future.add_done_callback(release)
+
+        try:
+            results = future.result(timeout=self.request_timeout)
+        except FutureTimeout:
+            self.metrics.count("timeouts")
+            return 504, {"error": f"navigation took longer than {self.request_timeout}s"}
+        except Exception as e:
+            self.metrics.count("errors")
+            print(f"Navigation request failed: {str(e)}")
+            return 500, {"error": str(e)}
+
+        elapsed = time.perf_counter() - started
+        self.metrics.record_latency(elapsed)
+        return 200, {"mode": mode, "results": results, "elapsed_ms": round(1000 * elapsed, 1)}
+
+    def health(self) -> Dict:
+        return {"status": "ok", "uptime_s": self.metrics.snapshot()["uptime_s"]}
+
+    def metrics_snapshot(self) -> Dict:
+        data = {"service": self.metrics.snapshot(), "startup": startup_report()}
+        if components.is_built("traffic_manager"):
+            data["traffic_cache"] = main.traffic_manager.cache_stats()
+        if components.is_built("tomtom_scheduler"):
+            data["scheduler"] = main.tomtom_scheduler.metrics()
+        if components.is_built("llm_cache"):
+            data["llm_cache"] = main.llm_cache.snapshot()
+        return data
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if components.is_built("traffic_manager"):
+            main.traffic_manager.close()
+
+
+def _parse_location(data: Optional[Dict], field: str) -> Location:
+    if not isinstance(data, dict):
+        raise ValueError(f"{field} must be an object with lat and lon")
+    try:
+        lat, lon = float(data["lat"]), float(data["lon"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"{field} needs numeric lat and lon") from None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"{field} coordinates out of range")
+    return Location(lat, lon, str(data.get("name", "")))
+
+
+def make_handler(service: NavigationService):
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "TrafficNavigation/1.0"
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, service.health())
+            elif self.path == "/metrics":
+                self._send(200, service.metrics_snapshot())
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/navigate":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                # the body cannot be skipped without a usable length, so drop the connection after answering
+                self.close_connection = True
+                self._send(400, {"error": "Content-Length must be a non-negative integer"})
+                return
+            if length > service.max_body_bytes:
+                self.close_connection = True
+                self._send(413, {"error": f"body larger than {service.max_body_bytes} bytes"})
+                return
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send(400, {"error": "body is not valid JSON"})
+                return
+            if not isinstance(body, dict):
+                self._send(400, {"error": "body must be a JSON object"})
+                return
+            self._send(*service.navigate(body))
+
+        def _send(self, status: int, body: Dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if status == 503:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            # keep access logs off the hot path; errors are printed where they happen
+            pass
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080, max_workers: int = 4,
+          queue_timeout: float = 5.0, request_timeout: float = 120.0, warm: bool = True,
+          max_body_bytes: int = MAX_BODY_BYTES):
+    service = NavigationService(max_workers, queue_timeout, request_timeout, max_body_bytes)
+    if warm:
+        service.warm()
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"Navigation service listening on http://{host}:{port} ({max_workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Smart Traffic Navigation HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=4, help="navigations running at once")
+    parser.add_argument("--queue-timeout", type=float, default=5.0,
+                        help="seconds a request waits for a free worker before a 503")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds before a request gets a 504")
+    parser.add_argument("--no-warm", action="store_true", help="build clients and agents on first request")
+    parser.add_argument("--max-body", type=int, default=MAX_BODY_BYTES,
+                        help="largest accepted request body in bytes (larger gets a 413)")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.queue_timeout, args.timeout, warm=not args.no_warm,
+          max_body_bytes=args.max_body)
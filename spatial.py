@@ -0,0 +1,383 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_EARTH_RADIUS_M = 6371008.8
+
+
+def geohash_encode(lat: float, lon: float, precision: int = 7) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits, ch, even = 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[ch])
+            bits, ch = 0, 0
+    return "".join(chars)
+
+
+def geohash_bbox(geohash: str) -> Tuple[float, float, float, float]:
+    """``(min_lat, min_lon, max_lat, max_lon)`` of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for c in geohash:
+        value = _BASE32.index(c)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if bit:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lon_lo, lat_hi, lon_hi
+
+
+def geohash_neighbors(geohash: str) -> List[str]:
+    """The 8 cells around ``geohash`` (fewer at the poles)."""
+    min_lat, min_lon, max_lat, max_lon = geohash_bbox(geohash)
+    dlat, dlon = max_lat - min_lat, max_lon - min_lon
+    lat, lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+    cells = []
+    for i in (-1, 0, 1):
+        for j in (-1, 0, 1):
+            if i == 0 and j == 0:
+                continue
+            n_lat = lat + i * dlat
+            if not -90 < n_lat < 90:
+                continue
+            n_lon = (lon + j * dlon + 180) % 360 - 180
+            cells.append(geohash_encode(n_lat, n_lon, len(geohash)))
+    return cells
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * _EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def point_to_polyline_m(lat: float, lon: float, points: Sequence[Tuple[float, float]]) -> float:
+    """Distance from a point to a polyline, on a local equirectangular projection (fine below ~10km)."""
+    kx = math.cos(math.radians(lat)) * math.pi / 180 * _EARTH_RADIUS_M
+    ky = math.pi / 180 * _EARTH_RADIUS_M
+    best = math.inf
+    prev = None
+    for p_lat, p_lon in points:
+        x, y = (p_lon - lon) * kx, (p_lat - lat) * ky
+        if prev is None:
+            best = min(best, math.hypot(x, y))
+        else:
+            px, py = prev
+            dx, dy = x - px, y - py
+            seg = dx * dx + dy * dy
+            t = 0.0 if seg == 0 else max(0.0, min(1.0, -(px * dx + py * dy) / seg))
+            best = min(best, math.hypot(px + t * dx, py + t * dy))
+        prev = (x, y)
+    return best
+
+
+@dataclass
+class _Segment:
+    points: List[Tuple[float, float]]
+    flow: Dict
+    stored_at: float
+    cells: Set[str]
+
+
+class FlowTileIndex:
+    """
+    Cached TomTom flow segments indexed by geohash cell.
+
+    A flow response describes a whole road segment, so any later query point
+    within ``match_distance_m`` of that segment's geometry is answered from
+    it instead of a new flow call. Segments are registered in every cell they
+    pass through; a query scans its own cell and the 8 neighbours, which at
+    the default precision 7 (~150m cells) covers the match distance.
+    """
+
+    def __init__(self, precision: int = 7, ttl: float = 60, match_distance_m: float = 40,
+                 max_segments: int = 5000, clock: Callable[[], float] = time.time):
+        self.precision = precision
+        self.ttl = ttl
+        self.match_distance_m = match_distance_m
+        self.max_segments = max_segments
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._segments: "OrderedDict[Tuple, _Segment]" = OrderedDict()
+        self._cells: Dict[str, Set[Tuple]] = {}
+        self._lock = threading.Lock()
+        # sample long edges at ~half a cell so every crossed cell is registered
+        cell_lat, cell_lon = self._cell_size()
+        self._step_deg = min(cell_lat, cell_lon) / 2
+
+    def _cell_size(self) -> Tuple[float, float]:
+        min_lat, min_lon, max_lat, max_lon = geohash_bbox(geohash_encode(0, 0, self.precision))
+        return max_lat - min_lat, max_lon - min_lon
+
+    def _covered_cells(self, points: Sequence[Tuple[float, float]]) -> Set[str]:
+        cells = set()
+        for i, (lat, lon) in enumerate(points):
+            cells.add(geohash_encode(lat, lon, self.precision))
+            if i == 0:
+                continue
+            p_lat, p_lon = points[i - 1]
+            steps = int(max(abs(lat - p_lat), abs(lon - p_lon)) / self._step_deg)
+            for k in range(1, steps + 1):
+                t = k / (steps + 1)
+                cells.add(geohash_encode(p_lat + t * (lat - p_lat), p_lon + t * (lon - p_lon), self.precision))
+        return cells
+
+    def add(self, points: Sequence[Tuple[float, float]], flow: Dict, stored_at: Optional[float] = None):
+        """Index ``flow`` for the segment ``points``, fetched at ``stored_at`` (default: now)."""
+        if not points:
+            return
+        points = [(float(lat), float(lon)) for lat, lon in points]
+        # TomTom returns the same geometry for every point on a segment
+        segment_id = (round(points[0][0], 5), round(points[0][1], 5),
+                      round(points[-1][0], 5), round(points[-1][1], 5))
+        segment = _Segment(points, flow, self.clock() if stored_at is None else stored_at,
+                           self._covered_cells(points))
+        with self._lock:
+            self._remove(segment_id)
+            self._segments[segment_id] = segment
+            for cell in segment.cells:
+                self._cells.setdefault(cell, set()).add(segment_id)
+            while len(self._segments) > self.max_segments:
+                self._remove(next(iter(self._segments)))
+
+    def nearest(self, lat: float, lon: float, max_distance_m: Optional[float] = None) -> Optional[Dict]:
+        """Flow of the closest fresh cached segment within ``max_distance_m``, or None."""
+        limit = self.match_distance_m if max_distance_m is None else max_distance_m
+        cell = geohash_encode(lat, lon, self.precision)
+        now = self.clock()
+        with self._lock:
+            best, best_distance = None, limit
+            for c in [cell] + geohash_neighbors(cell):
+                for segment_id in list(self._cells.get(c, ())):
+                    segment = self._segments.get(segment_id)
+                    if segment is None:
+                        continue
+                    if now - segment.stored_at >= self.ttl:
+                        self._remove(segment_id)
+                        continue
+                    distance = point_to_polyline_m(lat, lon, segment.points)
+                    if distance <= best_distance:
+                        best, best_distance = segment_id, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._segments.move_to_end(best)
+            return self._segments[best].flow
+
+    def _remove(self, segment_id: Tuple):
+        # caller holds self._lock
+        segment = self._segments.pop(segment_id, None)
+        if segment is None:
+            return
+        for cell in segment.cells:
+            ids = self._cells.get(cell)
+            if ids is not None:
+                ids.discard(segment_id)
+                if not ids:
+                    del self._cells[cell]
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "segments": len(self._segments),
+                "cells": len(self._cells),
+            }
+
+
+Bbox = Tuple[float, float, float, float]  # (min_lon, min_lat, max_lon, max_lat), TomTom's order
+
+
+class IncidentIndex:
+    """
+    In-memory incident store on a fixed lat/lon grid that remembers which
+    cells were fetched recently.
+
+    ``uncovered`` returns the part of a bbox (snapped out to whole cells) that
+    has no fresh coverage, or None when the whole bbox can be answered
+    locally with ``query``. Fetching exactly that snapped bbox and passing it
+    to ``add`` with the time the data was fetched marks all of its cells
+    covered as of then and replaces whatever they held before (unless a cell
+    holds newer data). Coverage is fresh for ``ttl`` and may still be served
+    stale for ``stale_ttl`` more seconds while it is refetched (``servable``).
+    Records are deduplicated by ``id`` and only need ``id`` and
+    ``location.lat``/``location.lon``.
+    """
+
+    def __init__(self, cell_deg: float = 0.01, ttl: float = 300, max_incidents: int = 20000,
+                 clock: Callable[[], float] = time.time, stale_ttl: float = 0):
+        self.cell_deg = cell_deg
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_incidents = max_incidents
+        self.clock = clock
+        self.local_queries = 0
+        self.remote_queries = 0
+        self._coverage: Dict[Tuple[int, int], float] = {}
+        self._incidents: "OrderedDict[str, Tuple[object, Tuple[int, int]]]" = OrderedDict()
+        self._cells: Dict[Tuple[int, int], Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def _cell_range(self, bbox: Bbox):
+        min_lon, min_lat, max_lon, max_lat = bbox
+        lat0, lon0 = self._cell(min_lat, min_lon)
+        lat1, lon1 = self._cell(max_lat, max_lon)
+        return range(lat0, lat1 + 1), range(lon0, lon1 + 1)
+
+    def uncovered(self, bbox: Bbox) -> Optional[Bbox]:
+        now = self.clock()
+        lat_range, lon_range = self._cell_range(bbox)
+        missing = []
+        with self._lock:
+            for i in lat_range:
+                for j in lon_range:
+                    fetched_at = self._coverage.get((i, j))
+                    if fetched_at is None or now - fetched_at >= self.ttl:
+                        missing.append((i, j))
+            if not missing:
+                self.local_queries += 1
+                return None
+            self.remote_queries += 1
+        return self._snap(missing)
+
+    def snap(self, bbox: Bbox) -> Bbox:
+        """``bbox`` snapped out to whole cells, to refetch all of it whatever its coverage."""
+        lat_range, lon_range = self._cell_range(bbox)
+        return self._snap([(lat_range[0], lon_range[0]), (lat_range[-1], lon_range[-1])])
+
+    def _snap(self, cells: Sequence[Tuple[int, int]]) -> Bbox:
+        lat_cells = [i for i, _ in cells]
+        lon_cells = [j for _, j in cells]
+        d = self.cell_deg
+        return (round(min(lon_cells) * d, 9), round(min(lat_cells) * d, 9),
+                round((max(lon_cells) + 1) * d, 9), round((max(lat_cells) + 1) * d, 9))
+
+    def servable(self, bbox: Bbox) -> bool:
+        """True when every cell of ``bbox`` is covered, if only stale (within ``stale_ttl``)."""
+        now = self.clock()
+        lat_range, lon_range = self._cell_range(bbox)
+        with self._lock:
+            return all(now - self._coverage.get((i, j), -math.inf) < self.ttl + self.stale_ttl
+                       for i in lat_range for j in lon_range)
+
+    def add(self, fetched_bbox: Bbox, records: Sequence, stored_at: Optional[float] = None):
+        """
+        Store ``records`` fetched for ``fetched_bbox`` (as returned by ``uncovered``)
+        at ``stored_at`` (default: now), e.g. the cache entry's fetch time.
+        """
+        now = self.clock()
+        if stored_at is None:
+            stored_at = now
+        min_lon, min_lat, max_lon, max_lat = fetched_bbox
+        # only cells lying entirely inside the fetched bbox count as covered
+        eps = self.cell_deg * 1e-6
+        lat_range, lon_range = self._cell_range((min_lon + eps, min_lat + eps, max_lon - eps, max_lat - eps))
+        with self._lock:
+            newer = set()
+            for i in lat_range:
+                for j in lon_range:
+                    if self._coverage.get((i, j), -math.inf) > stored_at:
+                        # an older response must not undo a newer one
+                        newer.add((i, j))
+                        continue
+                    self._coverage[(i, j)] = stored_at
+                    # the response replaces the cell, so cleared incidents go away
+                    for incident_id in list(self._cells.get((i, j), ())):
+                        self._remove(incident_id)
+            for record in records:
+                cell = self._cell(record.location.lat, record.location.lon)
+                if cell in newer:
+                    continue
+                self._remove(record.id)
+                self._incidents[record.id] = (record, cell)
+                self._cells.setdefault(cell, set()).add(record.id)
+            while len(self._incidents) > self.max_incidents:
+                self._remove(next(iter(self._incidents)))
+            self._drop_stale_coverage(now)
+
+    def query(self, bbox: Bbox) -> List:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        lat_range, lon_range = self._cell_range(bbox)
+        found = []
+        with self._lock:
+            for i in lat_range:
+                for j in lon_range:
+                    for incident_id in self._cells.get((i, j), ()):
+                        record = self._incidents[incident_id][0]
+                        loc = record.location
+                        if min_lat <= loc.lat <= max_lat and min_lon <= loc.lon <= max_lon:
+                            found.append(record)
+        return found
+
+    def _remove(self, incident_id: str):
+        # caller holds self._lock
+        entry = self._incidents.pop(incident_id, None)
+        if entry is None:
+            return
+        ids = self._cells.get(entry[1])
+        if ids is not None:
+            ids.discard(incident_id)
+            if not ids:
+                del self._cells[entry[1]]
+
+    def _drop_stale_coverage(self, now: float):
+        # caller holds self._lock; incidents in cells too old even to serve stale are dead weight
+        for cell in [c for c, t in self._coverage.items() if now - t >= self.ttl + self.stale_ttl]:
+            del self._coverage[cell]
+            for incident_id in list(self._cells.get(cell, ())):
+                self._remove(incident_id)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "local_queries": self.local_queries,
+                "remote_queries": self.remote_queries,
+                "incidents": len(self._incidents),
+                "covered_cells": len(self._coverage),
+            }
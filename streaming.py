@@ -0,0 +1,96 @@
+import asyncio
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+Emit = Callable[[Dict], None]
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """
+    Forwards streamed LLM tokens to a per-thread sink.
+
+    One ``llm`` is shared by every agent, and the crew runs each task in its
+    own thread, so the handler cannot know which task a token belongs to.
+    Instead each task thread installs a sink with ``with handler.sink(fn):``
+    and only sees its own tokens; threads without a sink drop them.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @contextmanager
+    def sink(self, callback: Optional[Callable[[str], None]]):
+        previous = getattr(self._local, "sink", None)
+        self._local.sink = callback
+        try:
+            yield
+        finally:
+            self._local.sink = previous
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        sink = getattr(self._local, "sink", None)
+        if sink is not None:
+            sink(token)
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_DONE = object()
+
+
+def stream_from_thread(run: Callable[[Emit], None]) -> Iterator[Dict]:
+    """
+    Run ``run(emit)`` in a background thread and yield every event it emits,
+    as it is emitted. An exception raised by ``run`` is re-raised here.
+    """
+    events: "queue.Queue" = queue.Queue()
+
+    def target():
+        try:
+            run(events.put)
+        except BaseException as e:
+            events.put(_Failure(e))
+        finally:
+            events.put(_DONE)
+
+    threading.Thread(target=target, name="navigation-stream", daemon=True).start()
+    while True:
+        event = events.get()
+        if event is _DONE:
+            return
+        if isinstance(event, _Failure):
+            raise event.error
+        yield event
+
+
+async def astream_from_thread(run: Callable[[Emit], None]) -> AsyncIterator[Dict]:
+    """Async variant of ``stream_from_thread``; the loop is never blocked waiting for events."""
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def emit(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def target():
+        try:
+            run(emit)
+        except BaseException as e:
+            emit(_Failure(e))
+        finally:
+            emit(_DONE)
+
+    threading.Thread(target=target, name="navigation-stream", daemon=True).start()
+    while True:
+        event = await events.get()
+        if event is _DONE:
+            return
+        if isinstance(event, _Failure):
+            raise event.error
+        yield event
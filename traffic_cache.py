@@ -0,0 +1,419 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+if TYPE_CHECKING:
+    from cache_store import SQLiteCacheStore
+
+# how long each kind of TomTom data stays fresh (seconds).
+# flow is refreshed by TomTom roughly every minute, incidents change slower,
+# routes are traffic-aware so they sit in between.
+DEFAULT_TTLS = {
+    "flow": 60,
+    "incidents": 300,
+    "routes": 180,
+}
+
+# how much longer an entry may be served stale while it is refreshed in the
+# background (stale-while-revalidate); past this it is refetched in the foreground
+DEFAULT_STALE_TTLS = {
+    "flow": 30,
+    "incidents": 120,
+    "routes": 60,
+}
+
+
+def quantize_point(lat: float, lon: float, precision: int = 4) -> Tuple[float, float]:
+    """Round a coordinate so nearby requests share a cache key (4 decimals ~ 11m)."""
+    return (round(lat, precision), round(lon, precision))
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    coalesced: int = 0
+    stale_hits: int = 0
+    refreshes: int = 0
+    store_hits: int = 0
+
+    def to_dict(self):
+        data = asdict(self)
+        lookups = self.hits + self.stale_hits + self.misses
+        data["hit_rate"] = (self.hits + self.stale_hits) / lookups if lookups else 0.0
+        return data
+
+
+class _Call:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls that share a key into one.
+
+    The first caller for a key runs ``fn``; callers arriving while it is still
+    running wait for it and get the same result (or the same exception).
+    ``do`` is for threads, ``do_async`` for coroutines on one event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: Dict[Hashable, "asyncio.Future"] = {}
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._async_calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield so one waiter being cancelled does not cancel the shared fetch
+            return await asyncio.shield(future)
+
+        future = self._async_calls[key] = asyncio.ensure_future(fn())
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                self._async_calls.pop(key, None)
+            else:
+                future.add_done_callback(lambda _: self._async_calls.pop(key, None))
+
+
+@dataclass
+class CacheEntry:
+    kind: str
+    value: Any
+    stored_at: float
+    stale_at: float
+    expires_at: float
+
+
+class TrafficCache:
+    """
+    Bounded LRU cache for TomTom responses with a TTL per data kind.
+    An optional ``store`` (see cache_store.SQLiteCacheStore) backs it on disk.
+
+    Keys are ``(kind, key)`` pairs, where ``kind`` is one of the entries in
+    ``ttls`` (flow, incidents, routes) and ``key`` is any hashable, usually
+    quantized coordinates. Safe to share between threads.
+
+    With ``stale_ttls`` set, an entry past its TTL (soft expiry) is still
+    served for up to ``stale_ttls[kind]`` more seconds (hard expiry) while a
+    single background refresh replaces it: stale-while-revalidate.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttls: Optional[Dict[str, float]] = None,
+                 clock: Callable[[], float] = time.time,
+                 stale_ttls: Optional[Dict[str, float]] = None, refresh_workers: int = 4,
+                 store: Optional["SQLiteCacheStore"] = None):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.stale_ttls = dict(stale_ttls or {})
+        self.clock = clock
+        # optional on-disk second level shared across restarts and processes;
+        # its timestamps are wall-clock, so keep the default clock when using it
+        self.store = store
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[Tuple[str, Hashable], CacheEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+        # concurrent misses on the same key share one fetch
+        self._flight = SingleFlight()
+        self._refresh_workers = refresh_workers
+        self._refresh_executor: Optional[ThreadPoolExecutor] = None
+        self._refreshing = set()
+        # background refresh tasks on the event loop; the loop only keeps weak references
+        self._refresh_tasks = set()
+
+    def _lookup(self, kind: str, key: Hashable, missing: Any) -> Tuple[Any, bool, float]:
+        """``(value, stale, stored_at)`` for the entry, or ``(missing, False, 0.0)``. Updates stats and LRU order."""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[(kind, key)]
+                self.stats.expirations += 1
+                entry = None
+        if entry is None:
+            # memory miss: fall back to the on-disk store (outside the lock, it does IO)
+            entry = self._load(kind, key, now)
+        with self._lock:
+            if entry is None:
+                self.stats.misses += 1
+                return missing, False, 0.0
+            if (kind, key) in self._entries:
+                self._entries.move_to_end((kind, key))
+            if entry.stale_at <= now:
+                self.stats.stale_hits += 1
+                return entry.value, True, entry.stored_at
+            self.stats.hits += 1
+            return entry.value, False, entry.stored_at
+
+    def _load(self, kind: str, key: Hashable, now: float) -> Optional[CacheEntry]:
+        if self.store is None:
+            return None
+        try:
+            row = self.store.get(kind, key, now)
+        except Exception as e:
+            print(f"Reading {kind} {key} from the cache store failed: {str(e)}")
+            return None
+        if row is None:
+            return None
+        value, stored_at, stale_at, expires_at = row
+        entry = CacheEntry(kind, value, stored_at, stale_at, expires_at)
+        with self._lock:
+            self.stats.store_hits += 1
+            self._insert(kind, key, entry)
+        return entry
+
+    def _insert(self, kind: str, key: Hashable, entry: CacheEntry):
+        # caller holds self._lock
+        self._entries[(kind, key)] = entry
+        self._entries.move_to_end((kind, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def get(self, kind: str, key: Hashable, default: Any = None) -> Any:
+        """Fresh value for the key; stale entries count as a miss here."""
+        missing = object()
+        value, stale, _ = self._lookup(kind, key, missing)
+        if value is missing or stale:
+            return default
+        return value
+
+    def set(self, kind: str, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if ttl is None:
+            ttl = self.ttls[kind]
+        now = self.clock()
+        stale_at = now + ttl
+        entry = CacheEntry(kind, value, now, stale_at, stale_at + self.stale_ttls.get(kind, 0))
+        with self._lock:
+            self._insert(kind, key, entry)
+        if self.store is not None:
+            try:
+                self.store.put(kind, key, value, entry.stored_at, entry.stale_at, entry.expires_at)
+            except Exception as e:
+                print(f"Writing {kind} {key} to the cache store failed: {str(e)}")
+
+    def _peek(self, kind: str, key: Hashable) -> Optional[Tuple[Any, float]]:
+        # fresh (value, stored_at) without touching stats or LRU order
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is None or entry.stale_at <= self.clock():
+                return None
+            return entry.value, entry.stored_at
+
+    def get_or_fetch(self, kind: str, key: Hashable, fetch: Callable[[], Any],
+                     refresh: Optional[Callable[[], Any]] = None, with_stored_at: bool = False) -> Any:
+        """
+        Return the cached value or call ``fetch`` and cache its result.
+        Empty results (None, {}, []) are returned but not cached, so a failed
+        request is retried on the next lookup instead of pinned for a full TTL.
+        Concurrent misses on the same key wait for a single ``fetch``.
+
+        A stale entry is returned as is and ``refresh`` (default: ``fetch``)
+        runs in the background to replace it. With ``with_stored_at`` the
+        result is ``(value, stored_at)``, the time the value was fetched.
+        """
+        missing = object()
+        value, stale, stored_at = self._lookup(kind, key, missing)
+        if value is not missing:
+            if stale:
+                self._refresh_in_background(kind, key, refresh or fetch)
+            return (value, stored_at) if with_stored_at else value
+
+        def fetch_and_store():
+            # a fetch that finished just before we became leader already stored it
+            return self._peek(kind, key) or self._store(kind, key, fetch())
+
+        value, stored_at = self._flight.do((kind, key), fetch_and_store)
+        return (value, stored_at) if with_stored_at else value
+
+    async def aget_or_fetch(self, kind: str, key: Hashable, fetch: Callable[[], Awaitable[Any]],
+                            refresh: Optional[Callable[[], Awaitable[Any]]] = None,
+                            with_stored_at: bool = False) -> Any:
+        """Same as ``get_or_fetch`` for coroutine-returning ``fetch``/``refresh``."""
+        missing = object()
+        value, stale, stored_at = self._lookup(kind, key, missing)
+        if value is not missing:
+            if stale:
+                self._refresh_in_background_async(kind, key, refresh or fetch)
+            return (value, stored_at) if with_stored_at else value
+
+        async def fetch_and_store():
+            return self._peek(kind, key) or self._store(kind, key, await fetch())
+
+        value, stored_at = await self._flight.do_async((kind, key), fetch_and_store)
+        return (value, stored_at) if with_stored_at else value
+
+    def refresh(self, kind: str, key: Hashable, fetch: Callable[[], Any],
+                refresh: Optional[Callable[[], Any]] = None, with_stored_at: bool = False) -> Any:
+        """
+        Fetch and store unconditionally (used to keep hot keys warm). Has the
+        same signature as ``get_or_fetch`` so callers can swap one for the other.
+        """
+        value, stored_at = self._flight.do(("refresh", kind, key),
+                                           lambda: self._store(kind, key, (refresh or fetch)()))
+        return (value, stored_at) if with_stored_at else value
+
+    def revalidate(self, kind: str, key: Hashable, refresh: Callable[[], Any]):
+        """
+        Run ``refresh`` in the background and store its result, at most one
+        at a time per key; for data served from somewhere other than the
+        cache (e.g. an index) that is due for a refetch.
+        """
+        self._refresh_in_background(kind, key, refresh)
+
+    def _store(self, kind: str, key: Hashable, value: Any) -> Tuple[Any, float]:
+        """Cache ``value`` if it is not empty; ``(value, stored_at)``."""
+        stored_at = self.clock()
+        if value:
+            self.set(kind, key, value)
+        return value, stored_at
+
+    def _claim_refresh(self, kind: str, key: Hashable) -> bool:
+        with self._lock:
+            if (kind, key) in self._refreshing:
+                return False
+            self._refreshing.add((kind, key))
+            self.stats.refreshes += 1
+            return True
+
+    def _release_refresh(self, kind: str, key: Hashable):
+        with self._lock:
+            self._refreshing.discard((kind, key))
+
+    def _refresh_in_background(self, kind: str, key: Hashable, refresh: Callable[[], Any]):
+        if not self._claim_refresh(kind, key):
+            return
+
+        def run():
+            try:
+                self._store(kind, key, refresh())
+            except Exception as e:
+                # the stale value keeps being served until the hard TTL
+                print(f"Background refresh of {kind} {key} failed: {str(e)}")
+            finally:
+                self._release_refresh(kind, key)
+
+        with self._lock:
+            if self._refresh_executor is None:
+                self._refresh_executor = ThreadPoolExecutor(
+                    max_workers=self._refresh_workers, thread_name_prefix="cache-refresh")
+        self._refresh_executor.submit(run)
+
+    def _refresh_in_background_async(self, kind: str, key: Hashable,
+                                     refresh: Callable[[], Awaitable[Any]]):
+        if not self._claim_refresh(kind, key):
+            return
+
+        async def run():
+            try:
+                self._store(kind, key, await refresh())
+            except Exception as e:
+                print(f"Background refresh of {kind} {key} failed: {str(e)}")
+            finally:
+                self._release_refresh(kind, key)
+
+        task = asyncio.ensure_future(run())
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    def invalidate(self, kind: Optional[str] = None):
+        with self._lock:
+            if kind is None:
+                self._entries.clear()
+            else:
+                for entry_key in [k for k in self._entries if k[0] == kind]:
+                    del self._entries[entry_key]
+        if self.store is not None:
+            self.store.clear(kind)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            self.stats.coalesced = self._flight.coalesced
+            data = self.stats.to_dict()
+            data["size"] = len(self._entries)
+            data["max_entries"] = self.max_entries
+            return data
+
+
+class ToolMemo:
+    """
+    Memoizes agent tool calls in a ``TrafficCache``.
+
+    Calls are keyed on the tool name and its normalized arguments (floats
+    rounded to ``precision`` decimals, strings trimmed and lowercased, dict
+    keys sorted), and each tool is its own cache kind with its own TTL. Use
+    the cache ``TrafficDataManager`` uses so tool results share its bounds,
+    stats and optional on-disk store.
+    """
+
+    def __init__(self, cache: TrafficCache, precision: int = 4):
+        self.cache = cache
+        self.precision = precision
+
+    def normalize(self, value: Any) -> Any:
+        if isinstance(value, float):
+            return round(value, self.precision)
+        if isinstance(value, str):
+            return " ".join(value.split()).lower()
+        if isinstance(value, dict):
+            return {str(k): self.normalize(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+        if isinstance(value, (list, tuple)):
+            return [self.normalize(v) for v in value]
+        if hasattr(value, "__dict__"):
+            return self.normalize(vars(value))
+        return value
+
+    def key(self, args: tuple, kwargs: Dict) -> str:
+        return json.dumps(self.normalize([list(args), kwargs]), separators=(",", ":"), default=str)
+
+    def call(self, name: str, ttl: float, fn: Callable[..., Any], args: tuple = (), kwargs: Optional[Dict] = None) -> Any:
+        kind = f"tool:{name}"
+        self.cache.ttls.setdefault(kind, ttl)
+        kwargs = kwargs or {}
+        return self.cache.get_or_fetch(kind, self.key(args, kwargs), lambda: fn(*args, **kwargs))